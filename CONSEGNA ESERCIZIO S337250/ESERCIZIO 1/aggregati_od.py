@@ -0,0 +1,127 @@
+import os
+import shutil
+import sys
+from pathlib import Path
+
+import numpy as np
+
+root_dir = Path(__file__).resolve().parent.parent
+if str(root_dir) not in sys.path:
+    sys.path.insert(0, str(root_dir))
+
+from od_cube import N_DOW, N_HOURS, ODCube
+from schema import OPERATORI
+from trip_store import TRIP_STORE_DIR, apri_trip_store, carica_corse
+from zone_corse import zone_torino
+
+# Aggregati OD mantenuti insieme al trip store, una partizione per (operatore, mese)
+# come le cartelle del trip store. Ogni file contiene il sotto-cubo
+# giorno x ora x origine x destinazione (sparso: indici e conteggi delle celle non nulle)
+# e i conteggi per zona di origine e di destinazione (giorno x ora x zona).
+# Un nuovo mese aggiunge solo le sue partizioni. Le correzioni tardive di un operatore
+# arrivano come export di sostituzione (ingest.SOSTITUZIONE): la partizione (operatore, mese)
+# del trip store viene svuotata e ricaricata dal nuovo file, poi il suo sotto-cubo ricalcolato.
+# Il cubo completo (od_cube.ODCube) è la somma delle partizioni.
+AGGREGATI_DIR = "Corse_Torino_aggregati_od"
+
+
+def percorso_partizione(operatore, mese, aggregati_path=AGGREGATI_DIR):
+    return os.path.join(aggregati_path, f"{operatore}_{mese}.npz")
+
+
+def partizioni_store(store_path=TRIP_STORE_DIR):
+    # coppie (operatore, mese) presenti nel trip store
+    coppie = apri_trip_store(store_path).to_table(columns=["OPERATORE", "MESE"]).to_pandas()
+    return set(coppie.drop_duplicates().itertuples(index=False, name=None))
+
+
+def calcola_partizione(operatore, mese, store_path=TRIP_STORE_DIR):
+    # ODCube delle corse di una partizione (un solo operatore sul primo asse)
+    df = carica_corse(
+        colonne=["DATAORA_INIZIO", "ORIGIN_ZONE", "DEST_ZONE"],
+        operatori=[operatore],
+        mesi=[mese],
+        percorso=store_path,
+    )
+    inizio = df["DATAORA_INIZIO"]
+    return ODCube.from_codes(
+        np.zeros(len(df), dtype=np.int64),
+        inizio.dt.dayofweek.fillna(-1).to_numpy(),
+        inizio.dt.hour.fillna(-1).to_numpy(),
+        df["ORIGIN_ZONE"].to_numpy(),
+        df["DEST_ZONE"].to_numpy(),
+        [operatore],
+        zone_torino().geo["DENOM"],
+    ), len(df)
+
+
+def salva_partizione(cubo, operatore, mese, aggregati_path=AGGREGATI_DIR):
+    od = cubo.counts[0].ravel()
+    celle = np.flatnonzero(od)
+    np.savez_compressed(
+        percorso_partizione(operatore, mese, aggregati_path),
+        celle=celle.astype(np.int32),
+        conteggi=od[celle].astype(np.int32),
+        origini=cubo.origin_counts[0].astype(np.int32),
+        destinazioni=cubo.dest_counts[0].astype(np.int32),
+        zone=np.array(zone_torino().key or ""),
+    )
+
+
+def rimuovi_partizione(operatore, mese, aggregati_path=AGGREGATI_DIR):
+    percorso = percorso_partizione(operatore, mese, aggregati_path)
+    if os.path.exists(percorso):
+        os.remove(percorso)
+
+
+def aggiorna_aggregati(partizioni=None, store_path=TRIP_STORE_DIR, aggregati_path=AGGREGATI_DIR):
+    # partizioni: coppie (operatore, mese) da ricalcolare; None = ricostruzione completa.
+    # Una partizione senza corse nel trip store viene rimossa.
+    # Restituisce il numero di partizioni scritte
+    if partizioni is None:
+        shutil.rmtree(aggregati_path, ignore_errors=True)
+        partizioni = partizioni_store(store_path)
+    os.makedirs(aggregati_path, exist_ok=True)
+
+    scritte = 0
+    for operatore, mese in sorted(partizioni):
+        cubo, n = calcola_partizione(operatore, mese, store_path)
+        if n == 0:
+            rimuovi_partizione(operatore, mese, aggregati_path)
+            continue
+        salva_partizione(cubo, operatore, mese, aggregati_path)
+        scritte += 1
+    return scritte
+
+
+def carica_cubo_od(operatori=None, mesi=None, aggregati_path=AGGREGATI_DIR):
+    # Somma delle partizioni in un ODCube (operatori nell'ordine di schema.OPERATORI),
+    # senza rileggere le corse. operatori / mesi: filtri sulle partizioni
+    if not os.path.exists(aggregati_path):
+        raise FileNotFoundError(
+            f"{aggregati_path} non trovato: eseguire prima ESERCIZIO 1/unione.py"
+        )
+    zone = zone_torino()
+    n_zone = len(zone)
+    forma = (len(OPERATORI), N_DOW, N_HOURS, n_zone, n_zone)
+    od = np.zeros(forma, dtype=np.int64)
+    origini = np.zeros(forma[:4], dtype=np.int64)
+    destinazioni = np.zeros(forma[:4], dtype=np.int64)
+
+    for nome in sorted(os.listdir(aggregati_path)):
+        operatore, _, mese = nome[:-len(".npz")].partition("_")
+        if operatore not in OPERATORI:
+            continue
+        if (operatori is not None and operatore not in operatori) or (mesi is not None and mese not in mesi):
+            continue
+        with np.load(os.path.join(aggregati_path, nome)) as dati:
+            if str(dati["zone"]) != (zone.key or ""):
+                raise ValueError(
+                    f"{nome}: aggregati calcolati con un altro file delle zone, rieseguire ESERCIZIO 1/unione.py"
+                )
+            i = OPERATORI.index(operatore)
+            od[i].reshape(-1)[dati["celle"]] += dati["conteggi"]
+            origini[i] += dati["origini"]
+            destinazioni[i] += dati["destinazioni"]
+
+    return ODCube(od, OPERATORI, zone.geo["DENOM"], origini, destinazioni)
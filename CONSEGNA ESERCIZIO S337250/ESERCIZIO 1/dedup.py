@@ -0,0 +1,186 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# Indice persistente dei duplicati: array ordinati di hash uint64
+#   "corse"     -> chiave canonica (veicolo, inizio al secondo, coordinate arrotondate)
+#   "attributi" -> allineato a "corse": impronta di fine corsa, durata e distanza
+#                  (COLONNE_ATTRIBUTI) dell'ultima versione tenuta della corsa
+#   "finestre"  -> (veicolo, finestra temporale di FINESTRA_QUASI_DUPLICATI_S secondi)
+# Controllo e aggiornamento usano ricerca binaria sugli array ordinati: nessun
+# ordinamento della tabella delle corse, né tra blocchi né tra caricamenti diversi.
+# Una riga con una chiave già vista è un duplicato se ha gli stessi attributi (re-invio),
+# altrimenti è una correzione: vince l'ultima versione ricevuta.
+INDICE_DEDUP_PATH = "Corse_Torino_indice_dedup.npz"
+
+# 4 decimali ~ 10 m: assorbe il rumore float e gli arrotondamenti dei re-invii
+DECIMALI_COORD = 4
+
+# attributi confrontati tra versioni della stessa corsa e decimali dell'arrotondamento
+# (fine corsa al secondo)
+COLONNE_ATTRIBUTI = {"DURATA_MIN": 2, "DISTANZA_KM": 3}
+
+# Corse dello stesso veicolo iniziate a meno di questa distanza (tra T e 2T secondi al
+# massimo, per via delle finestre fisse) vengono segnalate come quasi-duplicati,
+# non rimosse. None disattiva il controllo.
+FINESTRA_QUASI_DUPLICATI_S = 60
+
+COLONNE_COORD = [
+    "LATITUDINE_INIZIO_CORSA",
+    "LONGITUTIDE_INIZIO_CORSA",
+    "LATITUDINE_FINE_CORSA",
+    "LONGITUTIDE_FINE_CORSA",
+]
+
+
+def indice_vuoto():
+    return {
+        "corse": np.empty(0, dtype=np.uint64),
+        "attributi": np.empty(0, dtype=np.uint64),
+        "finestre": np.empty(0, dtype=np.uint64),
+    }
+
+
+def carica_indice(percorso=INDICE_DEDUP_PATH):
+    if not os.path.exists(percorso):
+        return indice_vuoto()
+    with np.load(percorso) as dati:
+        if "attributi" not in dati.files:
+            raise ValueError(
+                f"{percorso}: indice senza attributi delle corse, rieseguire ESERCIZIO 1/unione.py "
+                "in una modalità completa prima del caricamento incrementale"
+            )
+        return {"corse": dati["corse"], "attributi": dati["attributi"], "finestre": dati["finestre"]}
+
+
+def salva_indice(indice, percorso=INDICE_DEDUP_PATH):
+    temporaneo = percorso + ".tmp.npz"
+    np.savez(temporaneo, **indice)
+    os.replace(temporaneo, percorso)
+
+
+def contiene(ordinati, valori):
+    if not len(ordinati):
+        return np.zeros(len(valori), dtype=bool)
+    posizioni = np.searchsorted(ordinati, valori)
+    posizioni[posizioni == len(ordinati)] = 0
+    return ordinati[posizioni] == valori
+
+
+def togli(ordinati, valori):
+    # maschera delle voci di `ordinati` da tenere
+    return ~contiene(np.unique(valori), ordinati)
+
+
+def inserisci(ordinati, nuovi):
+    nuovi = np.unique(nuovi)
+    nuovi = nuovi[~contiene(ordinati, nuovi)]
+    return np.insert(ordinati, np.searchsorted(ordinati, nuovi), nuovi)
+
+
+def aggiorna_chiavi(ordinati, valori, chiavi, nuovi_valori):
+    # chiavi senza ripetizioni: quelle già presenti cambiano valore, le altre sono inserite
+    ordine = np.argsort(chiavi)
+    chiavi, nuovi_valori = chiavi[ordine], nuovi_valori[ordine]
+    presenti = contiene(ordinati, chiavi)
+    valori = valori.copy()
+    valori[np.searchsorted(ordinati, chiavi[presenti])] = nuovi_valori[presenti]
+    posizioni = np.searchsorted(ordinati, chiavi[~presenti])
+    return np.insert(ordinati, posizioni, chiavi[~presenti]), np.insert(valori, posizioni, nuovi_valori[~presenti])
+
+
+def hash_colonne(colonne):
+    return pd.util.hash_pandas_object(pd.DataFrame(colonne), index=False).to_numpy()
+
+
+def secondi(colonna):
+    return ((colonna.dt.round("s") - pd.Timestamp(0)) // pd.Timedelta(seconds=1)).to_numpy(dtype=np.int64)
+
+
+def secondi_inizio(df):
+    return secondi(df["DATAORA_INIZIO"])
+
+
+def chiave_canonica(df, decimali=DECIMALI_COORD):
+    # ID_VEICOLO category: l'hash dipende dal valore, non dal codice del blocco
+    colonne = {
+        "veicolo": pd.util.hash_pandas_object(df["ID_VEICOLO"], index=False).to_numpy(),
+        "inizio": secondi_inizio(df),
+    }
+    for col in COLONNE_COORD:
+        valori = df[col].to_numpy(dtype=np.float64)
+        colonne[col] = np.rint(valori * 10 ** decimali).astype(np.int64)
+    return hash_colonne(colonne)
+
+
+def impronta_attributi(df):
+    colonne = {"fine": secondi(df["DATAORA_FINE"])}
+    for col, decimali in COLONNE_ATTRIBUTI.items():
+        colonne[col] = np.rint(df[col].to_numpy(dtype=np.float64) * 10 ** decimali).astype(np.int64)
+    return hash_colonne(colonne)
+
+
+def finestre(df, finestra_s, scarto=0):
+    veicolo = pd.util.hash_pandas_object(df["ID_VEICOLO"], index=False).to_numpy()
+    return hash_colonne({"veicolo": veicolo, "finestra": secondi_inizio(df) // finestra_s + scarto})
+
+
+def rimuovi_dall_indice(indice, df, finestra_s=FINESTRA_QUASI_DUPLICATI_S, decimali=DECIMALI_COORD):
+    # Toglie dall'indice corse già tenute che escono dal trip store (file operatore
+    # ricaricato). Si tolgono anche le loro finestre: una corsa rimasta nella stessa
+    # finestra perde solo la segnalazione dei quasi-duplicati futuri, non la chiave
+    if df.empty:
+        return indice
+    tenere = togli(indice["corse"], chiave_canonica(df, decimali))
+    indice["corse"] = indice["corse"][tenere]
+    indice["attributi"] = indice["attributi"][tenere]
+    if finestra_s:
+        indice["finestre"] = indice["finestre"][togli(indice["finestre"], finestre(df, finestra_s))]
+    return indice
+
+
+def deduplica(df, indice, finestra_s=FINESTRA_QUASI_DUPLICATI_S, decimali=DECIMALI_COORD):
+    # df: corse che superano le altre regole di pulizia.
+    # Restituisce (duplicati, sostituite, correzioni, quasi_duplicati, indice aggiornato).
+    # Per ogni chiave vince la versione (attributi) dell'ultima riga del blocco:
+    # - sostituite: righe del blocco con una versione diversa da quella che vince
+    # - duplicati: stessa versione di una riga precedente del blocco o di quella nell'indice
+    # - correzioni: righe tenute la cui chiave è nell'indice con un'altra versione; la corsa
+    #   già scritta va tolta dal trip store (ingest.togli_versioni_precedenti)
+    chiavi = chiave_canonica(df, decimali)
+    attributi = impronta_attributi(df)
+    ultima = pd.Series(attributi).groupby(chiavi).transform("last").to_numpy(dtype=np.uint64)
+    sostituite = attributi != ultima
+
+    duplicati = np.zeros(len(df), dtype=bool)
+    duplicati[~sostituite] = pd.Series(chiavi[~sostituite]).duplicated().to_numpy()
+    nota = contiene(indice["corse"], chiavi)
+    stessa_versione = np.zeros(len(df), dtype=bool)
+    stessa_versione[nota] = indice["attributi"][np.searchsorted(indice["corse"], chiavi[nota])] == attributi[nota]
+    duplicati |= ~sostituite & stessa_versione
+    tenute = ~duplicati & ~sostituite
+    correzioni = tenute & nota
+
+    quasi = np.zeros(len(df), dtype=bool)
+    if finestra_s:
+        base = finestre(df, finestra_s)
+
+        # prima posizione nel blocco di ogni (veicolo, finestra) tra le corse tenute
+        posizione = np.arange(len(df))
+        prima = pd.Series(posizione[tenute]).groupby(base[tenute]).min()
+
+        # quasi-duplicato: stessa finestra o finestra adiacente già vista
+        # (nei caricamenti precedenti o in una riga precedente del blocco)
+        for scarto in (-1, 0, 1):
+            vicine = base if scarto == 0 else finestre(df, finestra_s, scarto)
+            quasi |= contiene(indice["finestre"], vicine)
+            quasi |= prima.reindex(vicine).to_numpy(dtype=np.float64) < posizione
+        # una correzione cade nella finestra della versione che sostituisce
+        quasi &= tenute & ~correzioni
+        indice["finestre"] = inserisci(indice["finestre"], base[tenute])
+
+    indice["corse"], indice["attributi"] = aggiorna_chiavi(
+        indice["corse"], indice["attributi"], chiavi[tenute], attributi[tenute]
+    )
+    return duplicati, sostituite, correzioni, quasi, indice
@@ -0,0 +1,590 @@
+import io
+import os
+import re
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from dedup import (
+    COLONNE_COORD,
+    carica_indice,
+    chiave_canonica,
+    contiene,
+    deduplica,
+    indice_vuoto,
+    rimuovi_dall_indice,
+    salva_indice,
+)
+from manifest import (
+    carica_manifest,
+    file_registrato,
+    impronta_file,
+    lotto_file,
+    registra_file,
+    salva_manifest,
+)
+from regole_pulizia import (
+    BIT_REGOLA,
+    REGOLE,
+    SOGLIE,
+    aggiungi_colonne_derivate,
+    bitmask,
+    conteggi_da_matrice,
+    valuta_regole,
+)
+from schema import applica_schema, concatena, memoria_mb
+from trip_store import (
+    QUARANTENA_DIR,
+    TRIP_STORE_DIR,
+    apri_trip_store,
+    colonna_mese,
+    rimuovi_lotto,
+    scrivi_trip_store,
+    svuota_partizione,
+    togli_righe,
+)
+from zone_corse import COLONNE_ZONA, aggiungi_zone
+
+# file storico di ogni operatore; tutte le modalità leggono ogni CSV della sua cartella
+# (elenca_file_operatori: storico, export mensili, export di sostituzione per ultimi)
+FILE_OPERATORI = {
+    "LIME": "OPERATORE A/Corse_Torino_LIME.csv",
+    "VOID": "OPERATORE B/Corse_Torino_VOID.csv",
+    "BIRD": "OPERATORE C/Corse_Torino_BIRD.csv",
+}
+
+# righe lette per blocco nella modalità streaming
+CHUNK_SIZE = 200_000
+
+# Export di sostituzione: un CSV nella cartella dell'operatore con nome che termina in
+# _sostituzione_AAAA-MM.csv sostituisce per intero la partizione (operatore, mese) indicata,
+# ad esempio una riconsegna corretta del mese da parte dell'operatore. In ogni modalità le
+# righe di quel mese arrivano solo dall'ultimo export di sostituzione (ultime_sostituzioni),
+# gli altri file le saltano, anche quando sono ricaricati dopo la sostituzione
+SOSTITUZIONE = re.compile(r"_sostituzione_(\d{4}-\d{2})\.csv$", re.IGNORECASE)
+
+# byte di CSV assegnati a ogni worker nella modalità parallela
+BLOCCO_BYTE = 64 * 1024 * 1024
+
+# Formati data/ora espliciti provati sul campione di ogni colonna (solo varianti
+# anno-prima, che il parsing 'mixed' con yearfirst=True interpreta allo stesso modo)
+FORMATI_DATA = [
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%d %H:%M:%S.%f",
+    "%Y-%m-%dT%H:%M:%S.%f",
+    "%Y-%m-%d %H:%M",
+    "%Y%m%d%H%M%S",
+]
+CAMPIONE_FORMATO = 1000
+MAX_FORMATI = 2
+# tipo fisso delle date, uguale in ogni blocco scritto nel trip store: to_datetime sceglie
+# l'unità in base al testo (ns con più di 6 cifre decimali, o sempre con pandas 2), le
+# cifre oltre il microsecondo sono troncate
+TIPO_DATA = "datetime64[us]"
+
+cols_finali = [
+    "ID_ORGANIZZAZIONE",
+    "ID_VEICOLO",
+    "DATAORA_INIZIO",
+    "DATAORA_FINE",
+    "LATITUDINE_INIZIO_CORSA",
+    "LONGITUTIDE_INIZIO_CORSA",
+    "LATITUDINE_FINE_CORSA",
+    "LONGITUTIDE_FINE_CORSA",
+    # "PERCORSO",   # la gestiamo separata
+    "DISTANZA_KM",
+    "DURATA_MIN",
+    "RISERVATO",
+    "BATTERIA_INIZIO_CORSA",
+    "BATTERIA_FINE_CORSA",
+    "OPERATORE",
+]
+
+def normalizza(df, operatore, conteggi=None):
+    # rinomina colonne specifiche per operatore
+    if operatore == "VOID":
+        df = df.rename(columns={
+            "Targa veicolo": "ID_VEICOLO",
+            "Data inizio corsa": "DATAORA_INIZIO",
+            "Data fine corsa": "DATAORA_FINE",
+            "Lat inizio corsa_coordinate": "LATITUDINE_INIZIO_CORSA",
+            "Lon inizio corsa_coordinate": "LONGITUTIDE_INIZIO_CORSA",
+            "Lat fine corsa_coordinate": "LATITUDINE_FINE_CORSA",
+            "Lon fine corsa_coordinate": "LONGITUTIDE_FINE_CORSA",
+            "KM Tot": "DISTANZA_KM",
+            "Tempo Tot": "DURATA_MIN",
+            "Prenotazione": "RISERVATO",
+            "Batteria inizio": "BATTERIA_INIZIO_CORSA",
+            "Batteria fine": "BATTERIA_FINE_CORSA",
+        })
+        df["ID_ORGANIZZAZIONE"] = pd.NA
+
+    elif operatore == "BIRD":
+        df = df.rename(columns={
+            "ID_VEICOLO": "ID_VEICOLO",
+            "DATAORA_INIZIO": "DATAORA_INIZIO",
+            "DATAORA_FINE": "DATAORA_FINE",
+            "LATITUDINE_INIZIO_CORSA": "LATITUDINE_INIZIO_CORSA",
+            "LONGITUTIDE_INIZIO_CORSA": "LONGITUTIDE_INIZIO_CORSA",
+            "LATITUDINE_FINE_CORSA": "LATITUDINE_FINE_CORSA",
+            "LONGITUTIDE_FINE_CORSA": "LONGITUTIDE_FINE_CORSA",
+            "DISTANZA_KM": "DISTANZA_KM",
+            "DURATA_MIN": "DURATA_MIN",
+            "RISERVATO": "RISERVATO",
+        })
+        df["ID_ORGANIZZAZIONE"] = pd.NA
+        df["BATTERIA_INIZIO_CORSA"] = pd.NA
+        df["BATTERIA_FINE_CORSA"] = pd.NA
+
+    elif operatore == "LIME":
+
+        df = df.rename(columns={
+            "ID_VEICOLO": "ID_VEICOLO",
+            "DATAORA_INIZIO": "DATAORA_INIZIO",
+            "DATAORA_FINE": "DATAORA_FINE",
+            "LATITUDINE_INIZIO_CORSA": "LATITUDINE_INIZIO_CORSA",
+            "LONGITUTIDE_INIZIO_CORSA": "LONGITUTIDE_INIZIO_CORSA",
+            "LATITUDINE_FINE_CORSA": "LATITUDINE_FINE_CORSA",
+            "LONGITUTIDE_FINE_CORSA": "LONGITUTIDE_FINE_CORSA",
+            "DISTANZA_KM": "DISTANZA_KM",
+            "DURATA_MIN": "DURATA_MIN",
+            "RISERVATO": "RISERVATO",
+            "BATTERIA_INIZIO_CORSA": "BATTERIA_INIZIO_CORSA",
+            "BATTERIA_FINE_CORSA": "BATTERIA_FINE_CORSA",
+            "ID_ORGANIZZAZIONE": "ID_ORGANIZZAZIONE",
+        })
+
+     # rimuovi PERCORSO dal main
+    df = df.drop(columns=["PERCORSO"], errors="ignore")
+
+    # aggiungi eventuali colonne mancanti
+    for c in cols_finali:
+        if c not in df.columns:
+            df[c] = pd.NA
+
+    # ordina le colonne nello stesso ordine e applica lo schema compatto
+    # (tipi fissi: ogni blocco ha lo stesso schema anche se una colonna è tutta vuota)
+    df = df[cols_finali]
+    if conteggi is None:
+        return applica_schema(df)
+
+    # conteggi (opzionale) accumula l'occupazione in memoria prima e dopo lo schema
+    memoria_prima = memoria_mb(df)
+    df = applica_schema(df)
+    conteggi["memoria_prima_mb"] = conteggi.get("memoria_prima_mb", 0) + memoria_prima
+    conteggi["memoria_dopo_mb"] = conteggi.get("memoria_dopo_mb", 0) + memoria_mb(df)
+    return df
+
+def rileva_formati(valori, formati=FORMATI_DATA, n=CAMPIONE_FORMATO, max_formati=MAX_FORMATI):
+    # Sceglie sul campione i formati che coprono più righe: il primo è quello
+    # più diffuso, i successivi coprono le righe rimaste escluse
+    valori = valori.dropna()
+    passo = max(len(valori) // n, 1)
+    campione = valori.iloc[::passo].iloc[:n]
+
+    scelti = []
+    rimasti = campione
+    while len(rimasti) and len(scelti) < max_formati:
+        copertura = {
+            fmt: pd.to_datetime(rimasti, format=fmt, errors="coerce").notna()
+            for fmt in formati if fmt not in scelti
+        }
+        migliore = max(copertura, key=lambda fmt: copertura[fmt].sum(), default=None)
+        if migliore is None or not copertura[migliore].any():
+            break
+        scelti.append(migliore)
+        rimasti = rimasti[~copertura[migliore]]
+    return scelti
+
+def parse_datetime_veloce(valori, formati=None):
+    # Parsing vettoriale con i formati rilevati; le righe che non rispettano nessuno
+    # dei formati passano dal parsing 'mixed' (elemento per elemento, lento).
+    # Restituisce (date, numero di righe finite nel percorso lento)
+    if formati is None:
+        formati = rileva_formati(valori)
+
+    risultato = pd.Series(pd.NaT, index=valori.index, dtype=TIPO_DATA)
+    for fmt in formati:
+        da_fare = risultato.isna() & valori.notna()
+        if not da_fare.any():
+            break
+        risultato[da_fare] = pd.to_datetime(valori[da_fare], format=fmt, errors="coerce").astype(TIPO_DATA)
+
+    lente = risultato.isna() & valori.notna()
+    if lente.any():
+        risultato[lente] = pd.to_datetime(valori[lente], format='mixed', yearfirst=True).astype(TIPO_DATA)
+    return risultato, int(lente.sum())
+
+def parse_datetime_generic(data_Str, conteggi=None):
+    # conteggi (opzionale) accumula in "date_lente" le righe passate dal parsing 'mixed'
+    lente = 0
+    for col in ["DATAORA_INIZIO", "DATAORA_FINE"]:
+        data_Str[col], n = parse_datetime_veloce(data_Str[col])
+        lente += n
+    if conteggi is not None:
+        conteggi["date_lente"] = conteggi.get("date_lente", 0) + lente
+    return data_Str
+
+def parse_datetime_void(data_Str):
+    data_Str["DATAORA_INIZIO"] = pd.to_datetime(data_Str["DATAORA_INIZIO"], format='%Y%m%d%H%M%S').astype(TIPO_DATA)
+    data_Str["DATAORA_FINE"] = pd.to_datetime(data_Str["DATAORA_FINE"], format='%Y%m%d%H%M%S').astype(TIPO_DATA)
+    return data_Str
+
+def pulisci_corse(data_all, indice=None, soglie=SOGLIE):
+    # Filtri di qualità (regole_pulizia.REGOLE) valutati in una sola passata vettoriale,
+    # senza una copia filtrata per ogni step. Restituisce (corse valide, righe rimosse
+    # per regola, quarantena, indice dei duplicati): la quarantena contiene le righe
+    # scartate con il bitmask di tutte le regole fallite (colonna REGOLE_FALLITE).
+    # indice: corse già tenute da blocchi o caricamenti precedenti (dedup.py); le corse
+    # valide che ne correggono una hanno CORREZIONE = True e la versione precedente va
+    # tolta dal trip store (togli_versioni_precedenti)
+    # Alle corse valide si aggiungono le zone di origine e destinazione (zone_corse.py)
+    data_all = aggiungi_colonne_derivate(data_all)
+    matrice, quasi, correzioni, indice = valuta_regole(data_all, soglie, indice)
+    conteggi = conteggi_da_matrice(matrice)
+    conteggi["quasi_duplicati"] = int(quasi.sum())
+    conteggi["correzioni"] = int(correzioni.sum())
+
+    scartate = matrice.any(axis=1)
+    quarantena = data_all[scartate].assign(REGOLE_FALLITE=bitmask(matrice[scartate]))
+    puliti = aggiungi_zone(data_all[~scartate].assign(QUASI_DUPLICATO=quasi[~scartate],
+                                                      CORREZIONE=correzioni[~scartate]))
+    return puliti, conteggi, quarantena, indice
+
+def togli_versioni_precedenti(corrette, store_path=TRIP_STORE_DIR, quarantena_path=QUARANTENA_DIR, lotto=None):
+    # Le corse corrette (CORREZIONE) sostituiscono quelle con la stessa chiave canonica già
+    # nel trip store: la stessa chiave implica stesso operatore e mese, quindi si riscrivono
+    # solo i file di quelle partizioni. Le versioni tolte passano in quarantena
+    # (regola "sostituite"). Restituisce il numero di corse tolte
+    chiavi = np.unique(chiave_canonica(corrette))
+    partizioni = set(zip(corrette["OPERATORE"].astype(str), colonna_mese(corrette)))
+    vecchie = togli_righe(lambda df: contiene(chiavi, chiave_canonica(df)), partizioni, store_path)
+    if not vecchie.empty:
+        vecchie = vecchie.drop(columns=["QUASI_DUPLICATO", "CORREZIONE", *COLONNE_ZONA], errors="ignore")
+        scrivi_trip_store(vecchie.assign(REGOLE_FALLITE=np.uint16(BIT_REGOLA["sostituite"])),
+                          quarantena_path, aggiungi=True, lotto=lotto)
+    return len(vecchie)
+
+def somma_conteggi(totale, parziale):
+    for k, v in parziale.items():
+        totale[k] = totale.get(k, 0) + v
+    return totale
+
+def stampa_report(conteggi):
+    # le chiavi mancano se non è stata letta nessuna riga (es. nessun file nuovo)
+    print("-" * 30)
+    print(f"REPORT PULIZIA DATI")
+    print(f"Righe totali iniziali: {conteggi.get('iniziali', 0)}")
+    if "date_lente" in conteggi:
+        print(f"Datetime values parsed with the slow mixed-format fallback: {conteggi['date_lente']}")
+    if "memoria_prima_mb" in conteggi:
+        print(f"Memory usage (default dtypes -> compact schema): "
+              f"{conteggi['memoria_prima_mb']:.1f} MB -> {conteggi['memoria_dopo_mb']:.1f} MB")
+    for nome, descrizione, _ in REGOLE:
+        print(f"{descrizione}: {conteggi.get(nome, 0)}")
+    print(f"Righe totali FINALI dopo pulizia: {conteggi.get('finali', 0)}")
+    print(f"Flagged near-duplicates (same vehicle, close start time; kept): {conteggi.get('quasi_duplicati', 0)}")
+    print(f"Corrections of trips from earlier blocks or loads (kept, replace the earlier version): "
+          f"{conteggi.get('correzioni', 0)}")
+    if conteggi.get("versioni_tolte"):
+        print(f"Earlier versions removed from the trip store: {conteggi['versioni_tolte']}")
+    if conteggi.get("escluse_sostituzione"):
+        print(f"Rows skipped, month replaced by a _sostituzione_ export: {conteggi['escluse_sostituzione']}")
+    print("-" * 30)
+
+def prepara_blocco(df_raw, operatore, conteggi=None, mesi_esclusi=()):
+    # normalizzazione + parsing date di un blocco di un solo operatore
+    # (il formato delle date viene quindi rilevato separatamente per ogni operatore);
+    # mesi_esclusi: mesi sostituiti da un altro file, le cui righe sono saltate
+    df = normalizza(df_raw, operatore, conteggi)
+    df = df.drop(columns=["ID_ORGANIZZAZIONE"], errors="ignore")
+    if operatore == "VOID":
+        df = parse_datetime_void(df)
+    else:
+        df = parse_datetime_generic(df, conteggi)
+    return escludi_mesi(df, mesi_esclusi, conteggi)
+
+def pulisci_blocco(blocco, operatore, indice, mesi_esclusi=()):
+    # normalizza, parsing date e filtri su un blocco grezzo di un operatore.
+    # indice: hash delle corse già tenute (dedup.py), restituito aggiornato
+    parsing = {}
+    blocco = prepara_blocco(blocco, operatore, parsing, mesi_esclusi)
+    blocco, parziali, quarantena, indice = pulisci_corse(blocco, indice)
+    parziali.update(parsing)
+    return blocco, parziali, indice, quarantena
+
+def ingest_streaming(output_path, chunksize=CHUNK_SIZE, store_path=TRIP_STORE_DIR,
+                     quarantena_path=QUARANTENA_DIR):
+    # Legge ogni file operatore a blocchi di `chunksize` righe: normalizza, parsing date e
+    # filtri vengono applicati blocco per blocco e il risultato è aggiunto in coda al CSV
+    # e al trip store. In memoria restano solo il blocco corrente e l'indice dei duplicati
+    # (dedup.py, 24 byte per corsa), usato per trovare duplicati e correzioni tra blocchi
+    # diversi; una correzione toglie dal trip store la versione scritta da un blocco precedente.
+    conteggi = {}
+    indice = indice_vuoto()
+
+    if os.path.exists(output_path):
+        os.remove(output_path)
+    shutil.rmtree(store_path, ignore_errors=True)
+    shutil.rmtree(quarantena_path, ignore_errors=True)
+    primo_blocco = True
+
+    file_operatori = list(elenca_file_operatori())
+    sostituzioni = ultime_sostituzioni(file_operatori)
+    for operatore, percorso in file_operatori:
+        esclusi = mesi_esclusi(operatore, percorso, sostituzioni)
+        # PERCORSO non serve qui: non lo leggiamo nemmeno
+        lettore = pd.read_csv(percorso, chunksize=chunksize, usecols=lambda c: c != "PERCORSO")
+        for blocco in lettore:
+            blocco, parziali, indice, quarantena = pulisci_blocco(blocco, operatore, indice, esclusi)
+            somma_conteggi(conteggi, parziali)
+            if not quarantena.empty:
+                scrivi_trip_store(quarantena, quarantena_path, aggiungi=True)
+
+            if blocco.empty:
+                continue
+            if blocco["CORREZIONE"].any():
+                somma_conteggi(conteggi, {"versioni_tolte": togli_versioni_precedenti(
+                    blocco[blocco["CORREZIONE"]], store_path, quarantena_path)})
+            blocco.to_csv(output_path, mode="w" if primo_blocco else "a", header=primo_blocco, index=False)
+            scrivi_trip_store(blocco, store_path, aggiungi=True)
+            primo_blocco = False
+
+    if conteggi.get("versioni_tolte"):
+        riscrivi_csv(output_path, store_path)
+    return conteggi
+
+def suddividi_file(percorso, blocco_byte=BLOCCO_BYTE):
+    # Divide il file in intervalli di byte [inizio, fine) che terminano sempre a fine riga.
+    # Si assume che nessun campo quotato contenga un a capo (vale per i CSV degli operatori).
+    dimensione = os.path.getsize(percorso)
+    intervalli = []
+    with open(percorso, "rb") as f:
+        inizio = len(f.readline())
+        while inizio < dimensione:
+            f.seek(min(inizio + blocco_byte, dimensione))
+            f.readline()
+            fine = min(f.tell(), dimensione)
+            intervalli.append((inizio, fine))
+            inizio = fine
+    return intervalli
+
+def elabora_porzione(operatore, percorso, inizio, fine, mesi_esclusi=()):
+    # Lavoro di un singolo worker: lettura di un intervallo del file, normalizza,
+    # parsing date e filtri (duplicati solo interni alla porzione: il resto dopo l'unione)
+    with open(percorso, "rb") as f:
+        intestazione = f.readline()
+        f.seek(inizio)
+        dati = f.read(fine - inizio)
+    blocco = pd.read_csv(io.BytesIO(intestazione + dati), usecols=lambda c: c != "PERCORSO")
+    parsing = {}
+    blocco = prepara_blocco(blocco, operatore, parsing, mesi_esclusi)
+    blocco, parziali, quarantena, _ = pulisci_corse(blocco)
+    parziali.update(parsing)
+    return blocco, parziali, quarantena
+
+def ingest_parallelo(max_workers=None, blocco_byte=BLOCCO_BYTE):
+    # Ogni file operatore, e ogni porzione di un file grande, è elaborato da un processo
+    # separato. I risultati sono uniti nell'ordine dei compiti (file nell'ordine di
+    # elenca_file_operatori, posizione nel file), quindi l'output non dipende da quale
+    # worker finisce prima.
+    file_operatori = list(elenca_file_operatori())
+    sostituzioni = ultime_sostituzioni(file_operatori)
+    compiti = [
+        (operatore, percorso, inizio, fine, mesi_esclusi(operatore, percorso, sostituzioni))
+        for operatore, percorso in file_operatori
+        for inizio, fine in suddividi_file(percorso, blocco_byte)
+    ]
+
+    conteggi = {}
+    blocchi = []
+    quarantene = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        risultati = executor.map(elabora_porzione, *zip(*compiti))
+        for blocco, parziali, quarantena in risultati:
+            somma_conteggi(conteggi, parziali)
+            blocchi.append(blocco)
+            quarantene.append(quarantena)
+
+    data_all = concatena(blocchi)
+
+    # Duplicati e correzioni tra porzioni diverse e quasi-duplicati ricalcolati sull'insieme:
+    # a parità di chiave e attributi resta la corsa della porzione che viene prima, a parità
+    # di chiave con attributi diversi l'ultima versione
+    duplicati, sostituite, _, quasi, _ = deduplica(data_all, indice_vuoto())
+    scartate = duplicati | sostituite
+    regola = np.where(sostituite, BIT_REGOLA["sostituite"], BIT_REGOLA["duplicati"]).astype(np.uint16)
+    quarantene.append(data_all[scartate].drop(columns=["QUASI_DUPLICATO", "CORREZIONE", *COLONNE_ZONA])
+                      .assign(REGOLE_FALLITE=regola[scartate]))
+    data_all = data_all[~scartate].assign(QUASI_DUPLICATO=quasi[~scartate])
+    conteggi["sostituite"] += int(sostituite.sum())
+    conteggi["duplicati"] += int(duplicati.sum())
+    conteggi["quasi_duplicati"] = int(quasi[~scartate].sum())
+    conteggi["finali"] = len(data_all)
+    return data_all, conteggi, concatena(quarantene)
+
+def mese_sostituito(percorso):
+    # mese (AAAA-MM) sostituito da un export di sostituzione, None per gli altri file
+    trovato = SOSTITUZIONE.search(os.path.basename(percorso))
+    return trovato.group(1) if trovato else None
+
+def elenca_file_operatori():
+    # tutti i CSV presenti nella cartella di ogni operatore (file storico + export mensili);
+    # gli export di sostituzione per ultimi, così prevalgono anche in una ricostruzione
+    for operatore, percorso in FILE_OPERATORI.items():
+        cartella = os.path.dirname(percorso)
+        nomi = [nome for nome in os.listdir(cartella) if nome.lower().endswith(".csv")]
+        for nome in sorted(nomi, key=lambda nome: (mese_sostituito(nome) is not None, nome)):
+            yield operatore, os.path.join(cartella, nome)
+
+def ultime_sostituzioni(file_operatori):
+    # (operatore, mese) -> export di sostituzione che vale per quel mese: l'ultimo
+    # nell'ordine di elenca_file_operatori
+    sostituzioni = {}
+    for operatore, percorso in file_operatori:
+        mese = mese_sostituito(percorso)
+        if mese is not None:
+            sostituzioni[(operatore, mese)] = percorso
+    return sostituzioni
+
+def mesi_esclusi(operatore, percorso, sostituzioni):
+    # mesi dell'operatore che arrivano da un altro file (export di sostituzione)
+    return {mese for (op, mese), ultimo in sostituzioni.items() if op == operatore and ultimo != percorso}
+
+def escludi_mesi(df, mesi, conteggi=None):
+    # Toglie le righe dei mesi sostituiti da un altro file: non sono pulite né messe in
+    # quarantena, il mese arriva per intero dal suo export di sostituzione
+    if not mesi:
+        return df
+    fuori = colonna_mese(df).isin(mesi).to_numpy()
+    if conteggi is not None:
+        conteggi["escluse_sostituzione"] = conteggi.get("escluse_sostituzione", 0) + int(fuori.sum())
+    return df[~fuori]
+
+def ritira_file(manifest, impronta, indice, store_path=TRIP_STORE_DIR, quarantena_path=QUARANTENA_DIR):
+    # Toglie da trip store, quarantena e indice dei duplicati le righe scritte da un file
+    # registrato nel manifest (file modificato, da ricaricare) e lo cancella dal manifest.
+    # Restituisce (partizioni (operatore, mese) in cui sono state tolte corse, corse tolte)
+    lotto = lotto_file(impronta)
+    rimosse = rimuovi_lotto(lotto, store_path, ["ID_VEICOLO", "DATAORA_INIZIO", *COLONNE_COORD])
+    rimuovi_lotto(lotto, quarantena_path)
+    rimuovi_dall_indice(indice, rimosse)
+    del manifest["file"][impronta]
+    return set(zip(rimosse["OPERATORE"], rimosse["MESE"])), len(rimosse)
+
+def sostituisci_partizione(operatore, mese, indice, store_path=TRIP_STORE_DIR, quarantena_path=QUARANTENA_DIR):
+    # Svuota la partizione (operatore, mese) di trip store e quarantena, qualunque file
+    # l'abbia scritta, e toglie le sue corse dall'indice dei duplicati: l'export di
+    # sostituzione caricato subito dopo ne diventa l'unico contenuto.
+    # Restituisce il numero di corse tolte dal trip store
+    rimosse = svuota_partizione(operatore, mese, store_path, ["ID_VEICOLO", "DATAORA_INIZIO", *COLONNE_COORD])
+    svuota_partizione(operatore, mese, quarantena_path)
+    rimuovi_dall_indice(indice, rimosse)
+    return len(rimosse)
+
+def riscrivi_csv(output_path, store_path=TRIP_STORE_DIR):
+    # CSV riscritto dal trip store a blocchi, con le colonne nell'ordine di prima
+    # (le righe tolte da ritira_file non si possono cancellare da un CSV in coda)
+    with open(output_path, encoding="utf-8") as f:
+        colonne = f.readline().strip().split(",")
+    temporaneo = output_path + ".tmp"
+    primo_blocco = True
+    for batch in apri_trip_store(store_path).to_batches(columns=colonne):
+        batch.to_pandas().to_csv(temporaneo, mode="w" if primo_blocco else "a", header=primo_blocco, index=False)
+        primo_blocco = False
+    os.replace(temporaneo, output_path)
+
+def ingest_incrementale(output_path, chunksize=CHUNK_SIZE, store_path=TRIP_STORE_DIR,
+                        quarantena_path=QUARANTENA_DIR):
+    # Carica solo i file non ancora registrati nel manifest (confronto per impronta SHA-256:
+    # un file rinominato non viene ricaricato). Le corse nuove sono pulite a blocchi e
+    # aggiunte in coda a CSV e trip store; l'indice dei duplicati (dedup.py) è salvato
+    # su disco, così duplicati e quasi-duplicati sono trovati anche tra export diversi.
+    # Un file già caricato ma modificato (stesso percorso, altra impronta) viene prima
+    # ritirato (ritira_file) e poi ricaricato per intero; l'export di sostituzione che vale
+    # per un mese (ultime_sostituzioni) svuota prima la sua partizione (operatore, mese), e
+    # gli altri file, anche ricaricati dopo, saltano le righe di quel mese.
+    # Il costo dipende solo dai file nuovi o modificati, non dalla lunghezza dello storico.
+    # Restituisce (conteggi, partizioni (operatore, mese) in cui sono state scritte o tolte
+    # corse), le sole da ricalcolare negli aggregati OD (aggregati_od.aggiorna_aggregati);
+    # None al primo caricamento, quando gli aggregati vanno ricostruiti tutti
+    manifest = carica_manifest()
+    ricostruzione = not manifest["file"]
+    if ricostruzione:
+        # primo caricamento (o dopo una ricostruzione completa): si riparte da zero
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        shutil.rmtree(store_path, ignore_errors=True)
+        shutil.rmtree(quarantena_path, ignore_errors=True)
+    indice = carica_indice()
+
+    conteggi = {"file_saltati": 0, "file_nuovi": 0, "file_modificati": 0, "partizioni_sostituite": 0,
+                "corse_ritirate": 0}
+    partizioni = set()
+    file_operatori = list(elenca_file_operatori())
+    sostituzioni = ultime_sostituzioni(file_operatori)
+    for operatore, percorso in file_operatori:
+        impronta = impronta_file(percorso)
+        if impronta in manifest["file"]:
+            conteggi["file_saltati"] += 1
+            continue
+
+        precedente = file_registrato(manifest, percorso)
+        if precedente is not None:
+            toccate, n = ritira_file(manifest, precedente, indice, store_path, quarantena_path)
+            partizioni |= toccate
+            salva_indice(indice)
+            salva_manifest(manifest)
+            conteggi["file_modificati"] += 1
+            conteggi["corse_ritirate"] += n
+            print(f"  {percorso}: modificato, ritirate {n} corse del caricamento precedente")
+
+        mese = mese_sostituito(percorso)
+        if sostituzioni.get((operatore, mese)) == percorso:
+            n = sostituisci_partizione(operatore, mese, indice, store_path, quarantena_path)
+            partizioni.add((operatore, mese))
+            salva_indice(indice)
+            conteggi["partizioni_sostituite"] += 1
+            conteggi["corse_ritirate"] += n
+            print(f"  {percorso}: sostituisce {operatore} {mese}, ritirate {n} corse")
+
+        esclusi = mesi_esclusi(operatore, percorso, sostituzioni)
+        watermark = manifest["watermark"].get(operatore)
+        conteggi_file = {}
+        inizio = fine = None
+        lettore = pd.read_csv(percorso, chunksize=chunksize, usecols=lambda c: c != "PERCORSO")
+        for blocco in lettore:
+            blocco, parziali, indice, quarantena = pulisci_blocco(blocco, operatore, indice, esclusi)
+            if not quarantena.empty:
+                scrivi_trip_store(quarantena, quarantena_path, aggiungi=True, lotto=lotto_file(impronta))
+            # corse nuove ma più vecchie del watermark (export in ritardo o correzioni)
+            if watermark is not None:
+                parziali["prima_watermark"] = int((blocco["DATAORA_INIZIO"] <= pd.Timestamp(watermark)).sum())
+            somma_conteggi(conteggi_file, parziali)
+
+            if blocco.empty:
+                continue
+            if blocco["CORREZIONE"].any():
+                somma_conteggi(conteggi_file, {"versioni_tolte": togli_versioni_precedenti(
+                    blocco[blocco["CORREZIONE"]], store_path, quarantena_path, lotto_file(impronta))})
+            inizio = min(inizio, blocco["DATAORA_INIZIO"].min()) if inizio is not None else blocco["DATAORA_INIZIO"].min()
+            fine = max(fine, blocco["DATAORA_INIZIO"].max()) if fine is not None else blocco["DATAORA_INIZIO"].max()
+            blocco.to_csv(output_path, mode="a", header=not os.path.exists(output_path), index=False)
+            scrivi_trip_store(blocco, store_path, aggiungi=True, lotto=lotto_file(impronta))
+            partizioni.update((operatore, mese) for mese in colonna_mese(blocco).unique())
+            # indice salvato dopo ogni blocco scritto: se il caricamento si interrompe,
+            # al riavvio le righe già scritte vengono riconosciute come duplicati
+            salva_indice(indice)
+
+        registra_file(manifest, impronta, percorso, operatore, conteggi_file, inizio, fine)
+        salva_manifest(manifest)
+        somma_conteggi(conteggi, conteggi_file)
+        conteggi["file_nuovi"] += 1
+        print(f"  {percorso}: {conteggi_file.get('finali', 0)} nuove corse")
+
+    if (conteggi["corse_ritirate"] or conteggi.get("versioni_tolte")) and os.path.exists(output_path):
+        riscrivi_csv(output_path, store_path)
+    return conteggi, (None if ricostruzione else partizioni)
@@ -0,0 +1,74 @@
+import hashlib
+import json
+import os
+from datetime import datetime
+
+from dedup import INDICE_DEDUP_PATH
+
+# Registro dei file operatore già caricati nel trip store (modalità "incrementale").
+# Per ogni file: impronta SHA-256, dimensione, righe lette/tenute e intervallo temporale;
+# per ogni operatore il watermark, cioè l'inizio corsa più recente già caricato.
+# I duplicati tra caricamenti diversi usano l'indice persistente di dedup.py.
+# Le corse di un file sono scritte nel trip store con il lotto del file (lotto_file) nel
+# nome dei file Parquet: se il file cambia, le sue corse precedenti si possono togliere.
+MANIFEST_PATH = "Corse_Torino_manifest.json"
+
+
+def impronta_file(percorso, blocco=1024 * 1024):
+    h = hashlib.sha256()
+    with open(percorso, "rb") as f:
+        for parte in iter(lambda: f.read(blocco), b""):
+            h.update(parte)
+    return h.hexdigest()
+
+
+def lotto_file(impronta):
+    return impronta[:16]
+
+
+def file_registrato(manifest, percorso):
+    # impronta con cui il percorso è già stato caricato (None se mai caricato)
+    for impronta, voce in manifest["file"].items():
+        if voce["percorso"] == percorso:
+            return impronta
+    return None
+
+
+def carica_manifest(percorso=MANIFEST_PATH):
+    if not os.path.exists(percorso):
+        return {"file": {}, "watermark": {}}
+    with open(percorso, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def salva_manifest(manifest, percorso=MANIFEST_PATH):
+    # scrittura su file temporaneo + rename: un'interruzione non lascia un manifest a metà
+    temporaneo = percorso + ".tmp"
+    with open(temporaneo, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temporaneo, percorso)
+
+
+def registra_file(manifest, impronta, percorso, operatore, conteggi, inizio, fine):
+    # inizio / fine: prima e ultima DATAORA_INIZIO tra le corse tenute (None se nessuna)
+    manifest["file"][impronta] = {
+        "percorso": percorso,
+        "operatore": operatore,
+        "dimensione_byte": os.path.getsize(percorso),
+        "righe_lette": conteggi.get("iniziali", 0),
+        "righe_aggiunte": conteggi.get("finali", 0),
+        "inizio": inizio.isoformat() if inizio is not None else None,
+        "fine": fine.isoformat() if fine is not None else None,
+        "elaborato_il": datetime.now().isoformat(timespec="seconds"),
+    }
+    if fine is not None:
+        watermark = manifest["watermark"].get(operatore)
+        if watermark is None or fine.isoformat() > watermark:
+            manifest["watermark"][operatore] = fine.isoformat()
+
+
+def azzera_manifest():
+    # dopo una ricostruzione completa il registro non è più valido
+    for percorso in (MANIFEST_PATH, INDICE_DEDUP_PATH):
+        if os.path.exists(percorso):
+            os.remove(percorso)
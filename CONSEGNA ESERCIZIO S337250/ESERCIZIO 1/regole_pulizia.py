@@ -0,0 +1,121 @@
+import numpy as np
+
+from dedup import deduplica, indice_vuoto
+from schema import concatena
+from trip_store import QUARANTENA_DIR, TRIP_STORE_DIR, apri_trip_store, carica_corse
+
+# Soglie dei filtri di qualità, modificabili senza toccare le regole
+SOGLIE = {
+    # Filtro Velocità (Tra 2 km/h e 25 km/h)
+    # 25 km/h = ~6.94 m/s (Limite legale monopattini spesso)
+    # 2 km/h = ~0.56 m/s (Sotto è probabilmente camminata o errore GPS)
+    "velocita_min_ms": 0.56,
+    "velocita_max_ms": 6.94,
+    # Approssimazione box Torino (latitudine e longitudine)
+    "lat_min": 44.9,
+    "lat_max": 45.1,
+    "lon_min": 7.5,
+    "lon_max": 7.8,
+}
+
+
+def fuori_box(df, soglie):
+    dentro = np.ones(len(df), dtype=bool)
+    for lat, lon in [("LATITUDINE_INIZIO_CORSA", "LONGITUTIDE_INIZIO_CORSA"),
+                     ("LATITUDINE_FINE_CORSA", "LONGITUTIDE_FINE_CORSA")]:
+        dentro &= df[lat].between(soglie["lat_min"], soglie["lat_max"]).to_numpy(dtype=bool)
+        dentro &= df[lon].between(soglie["lon_min"], soglie["lon_max"]).to_numpy(dtype=bool)
+    return ~dentro
+
+
+# Regole di pulizia, nell'ordine del report: (nome, riga del report, righe da scartare).
+# Il bit i del bitmask in quarantena corrisponde alla regola i di questa lista.
+# Versioni sostituite e duplicati (ultime due regole) sono cercati da dedup.deduplica solo
+# tra le righe che superano tutte le altre regole, con la chiave canonica invece che su
+# tutte le colonne.
+REGOLE = [
+    ("null", "Removed due to missing values (Nulls)",
+     lambda df, s: df[["ID_VEICOLO", "DATAORA_INIZIO", "DATAORA_FINE"]].isna().any(axis=1)),
+    ("tempo", "Removed due to time inconsistencies (End < Start)",
+     lambda df, s: ~(df["DATAORA_FINE"] > df["DATAORA_INIZIO"])),
+    ("durata_zero", "Removed due to non-positive duration",
+     lambda df, s: ~(df["DURATA_SEC"] > 0)),
+    ("velocita", "Removed due to unrealistic speed (<2km/h or >25km/h)",
+     lambda df, s: ~df["SPEED_MS"].between(s["velocita_min_ms"], s["velocita_max_ms"])),
+    ("posizione", "Removed due to out-of-bounds locations (outside Torino area)",
+     fuori_box),
+    ("sostituite", "Removed as superseded by a later correction (same trip, other duration/distance)",
+     None),
+    ("duplicati", "Removed duplicate trips (same vehicle, start second, position and attributes)",
+     None),
+]
+BIT_REGOLA = {nome: 1 << i for i, (nome, _, _) in enumerate(REGOLE)}
+
+
+def aggiungi_colonne_derivate(df):
+    # Assumiamo DURATA in MINUTI -> trasformiamo in SECONDI
+    df["DURATA_SEC"] = df["DURATA_MIN"] * 60
+    # Assumiamo DISTANZA in KM -> trasformiamo in METRI
+    df["DISTANZA_METRI"] = df["DISTANZA_KM"] * 1000
+    # Calcolo velocità in m/s (NaN se la durata non è positiva: la riga è già scartata)
+    df["SPEED_MS"] = df["DISTANZA_METRI"] / df["DURATA_SEC"].where(df["DURATA_SEC"] > 0)
+    return df
+
+
+def valuta_regole(df, soglie=SOGLIE, indice=None):
+    # Una sola passata vettoriale: matrice booleana righe x regole (True = regola fallita).
+    # indice: hash delle corse già tenute (blocchi o caricamenti precedenti), None = vuoto.
+    # Restituisce (matrice, quasi-duplicati per riga, correzioni per riga, indice aggiornato)
+    matrice = np.zeros((len(df), len(REGOLE)), dtype=bool)
+    for i, (_, _, fallisce) in enumerate(REGOLE):
+        if fallisce is not None:
+            matrice[:, i] = np.asarray(fallisce(df, soglie), dtype=bool)
+
+    valide = ~matrice.any(axis=1)
+    duplicati, sostituite, correzioni, quasi, indice = deduplica(
+        df[valide], indice if indice is not None else indice_vuoto()
+    )
+    matrice[valide, -2] = sostituite
+    matrice[valide, -1] = duplicati
+    quasi_duplicati = np.zeros(len(df), dtype=bool)
+    quasi_duplicati[valide] = quasi
+    correzioni_riga = np.zeros(len(df), dtype=bool)
+    correzioni_riga[valide] = correzioni
+    return matrice, quasi_duplicati, correzioni_riga, indice
+
+
+def bitmask(matrice):
+    pesi = np.array([1 << i for i in range(len(REGOLE))], dtype=np.uint16)
+    return (matrice.astype(np.uint16) * pesi).sum(axis=1).astype(np.uint16)
+
+
+def conteggi_da_matrice(matrice):
+    # Ogni riga scartata è attribuita alla prima regola fallita: i numeri coincidono
+    # con quelli della pulizia a passi successivi (ogni filtro sulle righe rimaste)
+    scartate = matrice.any(axis=1)
+    prima_fallita = matrice.argmax(axis=1)[scartate]
+    per_regola = np.bincount(prima_fallita, minlength=len(REGOLE))
+
+    conteggi = {"iniziali": len(matrice)}
+    for (nome, _, _), n in zip(REGOLE, per_regola):
+        conteggi[nome] = int(n)
+    conteggi["finali"] = int((~scartate).sum())
+    return conteggi
+
+
+def rivaluta_soglie(soglie):
+    # Ricalcola il report con soglie diverse sulle corse già caricate (trip store + quarantena),
+    # senza rileggere i CSV degli operatori. Si leggono solo le colonne comuni ai due dataset
+    # (non quelle aggiunte alle sole corse valide: QUASI_DUPLICATO, CORREZIONE, zone).
+    # La quarantena viene prima: tra due versioni della stessa corsa vince l'ultima,
+    # cioè quella nel trip store
+    colonne_quarantena = apri_trip_store(QUARANTENA_DIR).schema.names
+    colonne = [c for c in apri_trip_store(TRIP_STORE_DIR).schema.names
+               if c in colonne_quarantena and c != "MESE"]
+    df = concatena([
+        carica_corse(colonne=colonne, percorso=QUARANTENA_DIR),
+        carica_corse(colonne=colonne, percorso=TRIP_STORE_DIR),
+    ])
+    df = aggiungi_colonne_derivate(df)
+    matrice, _, _, _ = valuta_regole(df, soglie)
+    return conteggi_da_matrice(matrice)
@@ -0,0 +1,60 @@
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+OPERATORI = ["LIME", "VOID", "BIRD"]
+
+# Schema compatto della tabella unificata, applicato in normalizza:
+# - OPERATORE a categorie fisse, ID_VEICOLO a dizionario (codici interi + elenco targhe)
+# - coordinate in float32 (~0.5 m di risoluzione a Torino)
+# - batterie come interi piccoli nullabili (Int16: copre anche eventuali codici > 100)
+# - RISERVATO booleano nullabile
+# DISTANZA_KM e DURATA_MIN restano float64 perché entrano nel filtro velocità.
+# RISERVATO arriva come booleano, 0/1 o testo (SI/NO, ...): i valori noti sono convertiti con
+# VALORI_RISERVATO, gli altri diventano NA (la riga resta: il flag non entra nella pulizia).
+SCHEMA_COMPATTO = {
+    "ID_VEICOLO": "category",
+    "LATITUDINE_INIZIO_CORSA": "float32",
+    "LONGITUTIDE_INIZIO_CORSA": "float32",
+    "LATITUDINE_FINE_CORSA": "float32",
+    "LONGITUTIDE_FINE_CORSA": "float32",
+    "DISTANZA_KM": "float64",
+    "DURATA_MIN": "float64",
+    "RISERVATO": "boolean",
+    "BATTERIA_INIZIO_CORSA": "Int16",
+    "BATTERIA_FINE_CORSA": "Int16",
+    "OPERATORE": pd.CategoricalDtype(OPERATORI),
+}
+
+VALORI_RISERVATO = {
+    "1": True, "TRUE": True, "T": True, "SI": True, "SÌ": True, "S": True, "YES": True, "Y": True, "VERO": True,
+    "0": False, "FALSE": False, "F": False, "NO": False, "N": False, "FALSO": False,
+}
+
+
+def applica_schema(df):
+    sconosciuti = set(df["OPERATORE"].dropna().unique()) - set(OPERATORI)
+    if sconosciuti:
+        raise ValueError(f"Operatori non previsti nello schema: {sorted(sconosciuti)}")
+
+    for col in ["BATTERIA_INIZIO_CORSA", "BATTERIA_FINE_CORSA"]:
+        df[col] = pd.to_numeric(df[col], errors="coerce").round()
+
+    # testo normalizzato (1.0 / 0.0 delle colonne lette come float compresi)
+    testo = df["RISERVATO"].astype("string").str.strip().str.upper().str.replace(r"\.0+$", "", regex=True)
+    df["RISERVATO"] = testo.map(VALORI_RISERVATO)
+    return df.astype(SCHEMA_COMPATTO)
+
+
+def concatena(blocchi):
+    # pd.concat ricade su object se le categorie dei blocchi sono diverse (ID_VEICOLO):
+    # si uniscono prima le categorie, poi si concatena mantenendo i codici interi
+    blocchi = [b for b in blocchi if len(b)] or blocchi[:1]
+    for col in blocchi[0].columns:
+        if isinstance(blocchi[0][col].dtype, pd.CategoricalDtype):
+            categorie = union_categoricals([b[col] for b in blocchi]).categories
+            blocchi = [b.assign(**{col: b[col].cat.set_categories(categorie)}) for b in blocchi]
+    return pd.concat(blocchi, ignore_index=True)
+
+
+def memoria_mb(df):
+    return df.memory_usage(deep=True).sum() / 1024 ** 2
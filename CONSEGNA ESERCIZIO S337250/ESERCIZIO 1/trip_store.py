@@ -0,0 +1,138 @@
+import shutil
+import uuid
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from schema import OPERATORI, concatena
+
+# Dataset colonnare (Parquet) con le corse pulite, partizionato per operatore e mese.
+# Gli script degli altri esercizi leggono da qui solo colonne e partizioni che servono,
+# con DATAORA_INIZIO / DATAORA_FINE già tipizzate come datetime.
+TRIP_STORE_DIR = "Corse_Torino_TUTTI_parquet"
+
+# righe scartate dalla pulizia, stesso formato + colonna REGOLE_FALLITE (bitmask delle regole)
+QUARANTENA_DIR = "Corse_Torino_QUARANTENA_parquet"
+
+PARTIZIONAMENTO = ds.partitioning(
+    pa.schema([("OPERATORE", pa.string()), ("MESE", pa.string())]),
+    flavor="hive",
+)
+
+
+def colonna_mese(df):
+    # chiave di partizione temporale, es. "2024-05"
+    return df["DATAORA_INIZIO"].dt.strftime("%Y-%m")
+
+
+def scrivi_trip_store(df, percorso=TRIP_STORE_DIR, aggiungi=False, lotto=None):
+    # aggiungi=False ricostruisce il dataset da zero,
+    # aggiungi=True scrive nuovi file accanto a quelli esistenti (ingest a blocchi).
+    # lotto: prefisso dei nomi dei file scritti (es. il file operatore di provenienza),
+    # per poterli togliere in seguito con rimuovi_lotto
+    if not aggiungi:
+        shutil.rmtree(percorso, ignore_errors=True)
+
+    df = df.assign(MESE=colonna_mese(df))
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.cast(schema_store(table.schema))
+
+    ds.write_dataset(
+        table,
+        percorso,
+        format="parquet",
+        partitioning=PARTIZIONAMENTO,
+        basename_template=f"parte-{lotto + '-' if lotto else ''}{uuid.uuid4().hex}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+    )
+
+
+def schema_store(schema):
+    # Stesso schema Arrow per tutti i file del dataset: le colonne category di pandas
+    # diventano dizionari con indici int32 (pandas usa int8/int16 a seconda del blocco),
+    # le colonne di partizione stringhe semplici
+    campi = []
+    for campo in schema:
+        if campo.name in PARTIZIONAMENTO.schema.names:
+            campo = campo.with_type(pa.string())
+        elif pa.types.is_dictionary(campo.type):
+            campo = campo.with_type(pa.dictionary(pa.int32(), campo.type.value_type))
+        campi.append(campo)
+    return pa.schema(campi, metadata=schema.metadata)
+
+
+def apri_trip_store(percorso=TRIP_STORE_DIR):
+    return ds.dataset(percorso, format="parquet", partitioning=PARTIZIONAMENTO)
+
+
+def rimuovi_lotto(lotto, percorso=TRIP_STORE_DIR, colonne=()):
+    # Cancella i file scritti con scrivi_trip_store(..., lotto=lotto) e restituisce le loro
+    # righe (colonne richieste + OPERATORE e MESE), per aggiornare indici e aggregati
+    return rimuovi_file(sorted(Path(percorso).glob(f"*/*/parte-{lotto}-*.parquet")), percorso, colonne)
+
+
+def svuota_partizione(operatore, mese, percorso=TRIP_STORE_DIR, colonne=()):
+    # Cancella tutti i file di una partizione (operatore, mese), di qualunque lotto,
+    # e restituisce le loro righe come rimuovi_lotto
+    cartella = Path(percorso) / f"OPERATORE={operatore}" / f"MESE={mese}"
+    return rimuovi_file(sorted(cartella.glob("*.parquet")), percorso, colonne)
+
+
+def rimuovi_file(file, percorso, colonne):
+    colonne = [*colonne, "OPERATORE", "MESE"]
+    if not file:
+        return pd.DataFrame(columns=colonne)
+    righe = ds.dataset(
+        [str(f) for f in file], format="parquet", partitioning=PARTIZIONAMENTO, partition_base_dir=percorso
+    ).to_table(columns=colonne).to_pandas()
+    for f in file:
+        f.unlink()
+        # partizione rimasta vuota: la cartella non serve più
+        if not any(f.parent.iterdir()):
+            f.parent.rmdir()
+    return righe
+
+
+def togli_righe(scarta, partizioni, percorso=TRIP_STORE_DIR):
+    # Riscrive i file delle partizioni (operatore, mese) indicate senza le righe per cui
+    # scarta(df) è True; i file restano con lo stesso nome (e quindi lo stesso lotto).
+    # Restituisce le righe tolte, con la colonna OPERATORE
+    tolte = []
+    for operatore, mese in sorted(partizioni):
+        cartella = Path(percorso) / f"OPERATORE={operatore}" / f"MESE={mese}"
+        for f in sorted(cartella.glob("*.parquet")):
+            table = pq.read_table(f)
+            maschera = scarta(table.to_pandas())
+            if not maschera.any():
+                continue
+            tolte.append(table.filter(pa.array(maschera)).to_pandas().assign(OPERATORE=operatore))
+            if maschera.all():
+                f.unlink()
+            else:
+                pq.write_table(table.filter(pa.array(~maschera)), f)
+    return concatena(tolte) if tolte else pd.DataFrame()
+
+
+def carica_corse(colonne=None, operatori=None, mesi=None, percorso=TRIP_STORE_DIR):
+    # colonne: lista delle colonne da leggere (None = tutte)
+    # operatori / mesi: filtri sulle partizioni, le altre cartelle non vengono lette
+    if not Path(percorso).exists():
+        raise FileNotFoundError(
+            f"{percorso} non trovato: eseguire prima ESERCIZIO 1/unione.py"
+        )
+
+    filtro = None
+    if operatori is not None:
+        filtro = ds.field("OPERATORE").isin(list(operatori))
+    if mesi is not None:
+        filtro_mesi = ds.field("MESE").isin(list(mesi))
+        filtro = filtro_mesi if filtro is None else filtro & filtro_mesi
+
+    table = apri_trip_store(percorso).to_table(columns=colonne, filter=filtro)
+    df = table.to_pandas()
+    if "OPERATORE" in df.columns:
+        df["OPERATORE"] = df["OPERATORE"].astype(pd.CategoricalDtype(OPERATORI))
+    return df
@@ -0,0 +1,40 @@
+import sys
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+
+root_dir = Path(__file__).resolve().parent.parent
+if str(root_dir) not in sys.path:
+    sys.path.insert(0, str(root_dir))
+
+from zones import assign_zones, load_zones
+
+# Zone di origine e destinazione, calcolate una volta sola quando le corse pulite
+# vengono scritte e salvate nel trip store insieme alle corse:
+# - ORIGIN_ZONE / DEST_ZONE: codice int16 della zona (posizione in zones.load_zones().geo),
+#   -1 se il punto è fuori da tutte le zone
+# - DENTRO_ZONE: entrambe le estremità dentro una zona
+# I codici dipendono dal file delle zone: se cambia, va rieseguito ESERCIZIO 1/unione.py
+COLONNE_ZONA = ["ORIGIN_ZONE", "DEST_ZONE", "DENTRO_ZONE"]
+
+
+@lru_cache(maxsize=1)
+def zone_torino():
+    # una sola lettura per processo (anche nei worker della modalità parallela)
+    return load_zones()
+
+
+def aggiungi_zone(df):
+    codici = assign_zones(
+        zone_torino(),
+        np.stack([df["LONGITUTIDE_INIZIO_CORSA"].to_numpy(dtype=np.float64),
+                  df["LONGITUTIDE_FINE_CORSA"].to_numpy(dtype=np.float64)]),
+        np.stack([df["LATITUDINE_INIZIO_CORSA"].to_numpy(dtype=np.float64),
+                  df["LATITUDINE_FINE_CORSA"].to_numpy(dtype=np.float64)]),
+    )
+    return df.assign(
+        ORIGIN_ZONE=codici[0],
+        DEST_ZONE=codici[1],
+        DENTRO_ZONE=(codici >= 0).all(axis=0),
+    )
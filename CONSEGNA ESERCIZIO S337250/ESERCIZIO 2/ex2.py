@@ -1,107 +1,82 @@
+import sys
+from pathlib import Path
+
 import pandas as pd
-import geopandas as gpd
 import matplotlib.pyplot as plt
 import seaborn as sns
-from shapely import LineString, wkt
-from shapely.geometry import Point
+
+root_dir = Path(__file__).resolve().parent.parent
+esercizio_1_path = root_dir / "ESERCIZIO 1"
+if str(esercizio_1_path) not in sys.path:
+    sys.path.insert(0, str(esercizio_1_path))
+if str(root_dir) not in sys.path:
+    sys.path.insert(0, str(root_dir))
+
+from aggregati_od import carica_cubo_od
+from od_cube import flow_lines
+from trip_store import carica_corse
+from zones import load_zones, zone_names
 
 # ---------------------------------------------------------
 # 1. LOAD AND PREPARE THE MAP (ZONES)
 # ---------------------------------------------------------
 print("Loading Zoning Data...")
 
-
-ZONES_FILE= "zone_statistiche_csv/zone_statistiche.csv" 
-try:
-    zones_df = pd.read_csv(ZONES_FILE, sep=';', encoding='latin1')
-except:
-    zones_df = pd.read_csv(ZONES_FILE, sep=';', encoding='cp1252')
-
-if 'WKT_GEOM' not in zones_df.columns:
-    zones_df = pd.read_csv("zone_statistiche_csv/zone_statistiche.csv", sep=',')
-
-# CONVERT TEXT TO GEOMETRY
-
-zones_df['geometry'] = zones_df['WKT_GEOM'].apply(wkt.loads)
-
-# Create GeoDataFrame
-zones_gdf = gpd.GeoDataFrame(zones_df, geometry='geometry')
-
-# SET COORDINATE REFERENCE SYSTEM (CRS)
-zones_gdf.set_crs(epsg=3003, inplace=True)
-
-# CONVERT TO GPS COORDINATES (EPSG:4326) to match the scooters
-zones_gdf = zones_gdf.to_crs(epsg=4326)
+# Zones in GPS coordinates (EPSG:4326) to match the scooters (cached, see zones.py)
+zone_data = load_zones()
+zones_gdf = zone_data.geo
 
 print(f"Loaded {len(zones_gdf)} zones.")
 
 # ---------------------------------------------------------
-# 2. LOAD SCOOTER DATA & SPATIAL JOIN
+# 2. LOAD SCOOTER DATA & ZONE CODES
 # ---------------------------------------------------------
 print("Loading Scooter Data...")
-df = pd.read_csv("Corse_Torino_TUTTI.csv")
-df['DATAORA_INIZIO'] = pd.to_datetime(df['DATAORA_INIZIO'])
-
-# Convert Start/End to Geometry Points
-geometry_start = [Point(xy) for xy in zip(df.LONGITUTIDE_INIZIO_CORSA, df.LATITUDINE_INIZIO_CORSA)]
-geometry_end = [Point(xy) for xy in zip(df.LONGITUTIDE_FINE_CORSA, df.LATITUDINE_FINE_CORSA)]
+# zones of both endpoints are assigned once, when the trip store is written
+df = carica_corse(colonne=['OPERATORE', 'DATAORA_INIZIO', 'ORIGIN_ZONE', 'DEST_ZONE', 'DENTRO_ZONE'])
 
-gdf_start = gpd.GeoDataFrame(df, geometry=geometry_start, crs="EPSG:4326")
-gdf_end = gpd.GeoDataFrame(df, geometry=geometry_end, crs="EPSG:4326")
+print("Reading Zone Codes from the Trip Store...")
 
-print("Performing Spatial Join (Mapping GPS to Zones)...")
-
-# 1. Perform Spatial Joins
+# 1. Zone codes for origins and destinations, read from the trip store (-1 = outside every zone)
 target_column = 'DENOM' 
 
+origin_code = df['ORIGIN_ZONE'].to_numpy()
+dest_code = df['DEST_ZONE'].to_numpy()
 
-gdf_start = gpd.sjoin(gdf_start, zones_gdf[[target_column, 'geometry']], how="inner", predicate="within")
-gdf_end = gpd.sjoin(gdf_end, zones_gdf[[target_column, 'geometry']], how="inner", predicate="within")
-
-# 2. Rename columns to avoid confusion
-gdf_start = gdf_start.rename(columns={target_column: 'ORIGIN_ZONE'})
-gdf_end = gdf_end.rename(columns={target_column: 'DEST_ZONE'})
+# 2. CRITICAL FIX: keep only trips with BOTH valid Start AND End
+valid_trips = df['DENTRO_ZONE'].to_numpy()
 
-# 3. CRITICAL FIX: Find common indices (Trips with BOTH valid Start AND End)
-valid_trips_index = gdf_start.index.intersection(gdf_end.index)
+print(f"Trips starting in zone: {(origin_code >= 0).sum()}")
+print(f"Trips ending in zone: {(dest_code >= 0).sum()}")
+print(f"Valid Trips (Both inside): {valid_trips.sum()}")
 
-print(f"Trips starting in zone: {len(gdf_start)}")
-print(f"Trips ending in zone: {len(gdf_end)}")
-print(f"Valid Trips (Both inside): {len(valid_trips_index)}")
-
-# 4. Create the final dataframe using only the valid intersection
-df_zoned = df.loc[valid_trips_index].copy()
-df_zoned['ORIGIN_ZONE'] = gdf_start.loc[valid_trips_index, 'ORIGIN_ZONE']
-df_zoned['DEST_ZONE'] = gdf_end.loc[valid_trips_index, 'DEST_ZONE']
+# 3. Create the final dataframe using only the valid trips
+df_zoned = df[valid_trips].copy()
+df_zoned['ORIGIN_ZONE'] = zone_names(zone_data, origin_code[valid_trips], target_column)
+df_zoned['DEST_ZONE'] = zone_names(zone_data, dest_code[valid_trips], target_column)
 
 # ---------------------------------------------------------
 # 3. O-D MATRICES (Total, Peak, Off-Peak)
 # ---------------------------------------------------------
 print("Calculating Matrices...")
 
-# 3a. Total Matrix
-od_matrix_total = pd.crosstab(df_zoned['ORIGIN_ZONE'], df_zoned['DEST_ZONE'])
-
-# 3b. Temporal Split
-df_zoned['Hour'] = df_zoned['DATAORA_INIZIO'].dt.hour
-peak_hours = [7, 8, 9, 16, 17, 18, 19]
+# OD cube (operator x day of week x hour x origin x destination), maintained per
+# (operator, month) next to the trip store by ESERCIZIO 1/unione.py (aggregati_od.py):
+# every matrix below is a slice of the cube (see od_cube.TIME_BANDS for the bands)
+od_cube = carica_cubo_od()
 
-df_peak = df_zoned[df_zoned['Hour'].isin(peak_hours)]
-df_offpeak = df_zoned[~df_zoned['Hour'].isin(peak_hours)]
+# 3a. Total Matrix
+od_matrix_total = od_cube.frame()
 
-od_matrix_peak = pd.crosstab(df_peak['ORIGIN_ZONE'], df_peak['DEST_ZONE'])
-od_matrix_offpeak = pd.crosstab(df_offpeak['ORIGIN_ZONE'], df_offpeak['DEST_ZONE'])
+# 3b. Temporal Split (peak: 7-9 and 16-19)
+od_matrix_peak = od_cube.frame(hours="peak")
+od_matrix_offpeak = od_cube.frame(hours="offpeak")
 
 #create a map with origin destination lines, bidding the lines based on number of trips, consider only top 100 origin-destination pairs
-top_od_pairs = df_zoned.groupby(['ORIGIN_ZONE', 'DEST_ZONE']).size().nlargest(100)
 print("Creating Map Visualization for Top 100 O-D Pairs...")
-lines = []
-for (origin, dest), count in top_od_pairs.items():
-    origin_geom = zones_gdf[zones_gdf['DENOM'] == origin].geometry.centroid.values[0]
-    dest_geom = zones_gdf[zones_gdf['DENOM'] == dest].geometry.centroid.values[0]
-    line = LineString([origin_geom, dest_geom])
-    lines.append({'geometry': line, 'count': count})
-od_lines_gdf = gpd.GeoDataFrame(lines, geometry='geometry', crs="EPSG:4326")
+# lines between the zone centroids (computed in the metric CRS, see zones.py), straight from the cube;
+# operators= / days= / hours= give the same layer for one operator or time band
+od_lines_gdf = flow_lines(od_cube, zone_data, n=100)
 # Plotting the lines
 # Rebuild line width with a stronger scaling
 max_lw = 8
@@ -134,7 +109,7 @@ od_lines_gdf.plot(
 )
 
 # 3) Optionally add centroids as points
-zones_gdf.centroid.plot(
+zone_data.centroids_geo.plot(
     ax=ax,
     color="black",
     markersize=5,
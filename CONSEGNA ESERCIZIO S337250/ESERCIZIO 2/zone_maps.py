@@ -0,0 +1,31 @@
+import matplotlib.pyplot as plt
+
+# Side-by-side operator maps shared by trip_origins.py and trip_destinations.py.
+# counts: (operators, zones) array of od_cube.ZoneCounts, zone j = row j of zones_gdf,
+# so each operator's column is assigned to the zone table directly (no merge)
+
+
+def plot_operator_maps(zones_gdf, counts, operators, vmax, column, cmap, label, title):
+    n_operators = len(operators)
+
+    # Create a figure with subplots (1 row, N columns)
+    fig, axes = plt.subplots(1, n_operators, figsize=(6 * n_operators, 8))
+    # Ensure axes is a list even if there's only 1 operator
+    if n_operators == 1: axes = [axes]
+
+    for ax, op, op_counts in zip(axes, operators, counts):
+        op_map = zones_gdf.assign(**{column: op_counts})
+        op_map.plot(column=column,
+                    ax=ax,
+                    cmap=cmap,
+                    vmax=vmax, # Unified scale
+                    legend=True,
+                    legend_kwds={'label': label, 'shrink': 0.5},
+                    edgecolor='white', linewidth=0.2)
+
+        ax.set_title(f"Operator: {op}", fontsize=14, fontweight='bold')
+        ax.axis('off')
+
+    plt.suptitle(title, fontsize=16, y=0.95)
+    plt.tight_layout()
+    plt.show()
@@ -0,0 +1,206 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+from pyproj import CRS, Transformer
+
+root_dir = Path(__file__).resolve().parent.parent
+esercizio_1_path = root_dir / "ESERCIZIO 1"
+if str(esercizio_1_path) not in sys.path:
+    sys.path.insert(0, str(esercizio_1_path))
+if str(root_dir) not in sys.path:
+    sys.path.insert(0, str(root_dir))
+
+from gestione_percorso import PERCORSI_DIR
+from geometrie_percorso import tokenizza_percorsi
+from trip_store import apri_trip_store
+from zones import GRID_BOUNDS
+
+try:
+    import rasterio
+    from rasterio.transform import from_origin
+except ImportError:
+    rasterio = None
+
+# Densità d'uso delle strade: numero di tracce PERCORSO che attraversano ogni cella di una
+# griglia metrica (EPSG:32632) di CELLA_M metri, sul riquadro del filtro di pulizia
+# (zones.GRID_BOUNDS). Le tracce sono lette a blocchi dal testo PERCORSO e trasformate in
+# array di coordinate (tokenizza_percorsi), senza oggetti shapely; ogni segmento segna tutte
+# le celle che attraversa (incroci con le linee della griglia) e ogni traccia conta una volta
+# sola per cella. I segmenti sono tagliati sul bordo del raster; i punti non finiti o più
+# lontani di MARGINE_M dal raster (errori GPS, es. un punto a 0,0) spezzano la traccia.
+# Il risultato si accumula blocco dopo blocco, quindi copre tutti i mesi con memoria costante.
+DENSITA_PATH = "Corse_Torino_densita_percorsi"
+CELLA_M = 10
+MARGINE_M = 5_000
+RIGHE_BLOCCO = 200_000
+CRS_METRICO = "EPSG:32632"
+
+
+def raster_vuoto(cella_m=CELLA_M, limiti=GRID_BOUNDS):
+    # riquadro lon/lat -> riquadro metrico che lo contiene, righe dall'alto (nord) come nei GeoTIFF
+    trasformatore = Transformer.from_crs("EPSG:4326", CRS_METRICO, always_xy=True)
+    x_min, y_min, x_max, y_max = trasformatore.transform_bounds(*limiti)
+    x_min = np.floor(x_min / cella_m) * cella_m
+    y_max = np.ceil(y_max / cella_m) * cella_m
+    n_colonne = int(np.ceil((x_max - x_min) / cella_m))
+    n_righe = int(np.ceil((y_max - y_min) / cella_m))
+    return {
+        "conteggi": np.zeros((n_righe, n_colonne), dtype=np.int32),
+        "x_min": x_min,
+        "y_max": y_max,
+        "cella_m": cella_m,
+    }
+
+
+def taglia_segmenti(u0, u1, v0, v1, n_colonne, n_righe):
+    # Liang-Barsky: parte di ogni segmento dentro [0, n_colonne] x [0, n_righe] (unità di cella).
+    # Restituisce gli estremi tagliati e la maschera dei segmenti che toccano il raster
+    du, dv = u1 - u0, v1 - v0
+    t_in, t_out = np.zeros(len(u0)), np.ones(len(u0))
+    dentro = np.ones(len(u0), dtype=bool)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for p, q in ((-du, u0), (du, n_colonne - u0), (-dv, v0), (dv, n_righe - v0)):
+            r = q / p
+            t_in = np.where(p < 0, np.maximum(t_in, r), t_in)
+            t_out = np.where(p > 0, np.minimum(t_out, r), t_out)
+            dentro &= (p != 0) | (q >= 0)
+    dentro &= t_in <= t_out
+    return u0 + t_in * du, u0 + t_out * du, v0 + t_in * dv, v0 + t_out * dv, dentro
+
+
+def brucia_tracce(raster, coordinate, offsets, margine_m=MARGINE_M):
+    # Aggiunge al raster le tracce di un blocco: coordinate metriche n_punti x 2,
+    # punti della traccia i = coordinate[offsets[i]:offsets[i + 1]]
+    conteggi = raster["conteggi"]
+    n_righe, n_colonne = conteggi.shape
+    cella = raster["cella_m"]
+    traccia = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    # posizioni in unità di cella (colonna, riga dall'alto)
+    u = (coordinate[:, 0] - raster["x_min"]) / cella
+    v = (raster["y_max"] - coordinate[:, 1]) / cella
+
+    # punti non finiti o oltre margine_m dal raster (errori GPS, es. un punto a 0,0) tolti e
+    # traccia spezzata in quel punto
+    m = margine_m / cella
+    buono = np.isfinite(u) & np.isfinite(v) & (u >= -m) & (u <= n_colonne + m) & (v >= -m) & (v <= n_righe + m)
+    nuovo_pezzo = np.ones(len(u), dtype=bool)
+    nuovo_pezzo[1:] = (traccia[1:] != traccia[:-1]) | ~buono[:-1]
+    pezzo = np.cumsum(nuovo_pezzo)[buono]
+    traccia, u, v = traccia[buono], u[buono], v[buono]
+
+    # segmenti tra punti consecutivi dello stesso pezzo; i pezzi di un punto solo
+    # contano come segmento nullo sul proprio punto
+    stessa = pezzo[1:] == pezzo[:-1]
+    inizio = np.flatnonzero(stessa)
+    singoli = np.flatnonzero(np.bincount(pezzo)[pezzo] == 1)
+    da = np.concatenate([inizio, singoli])
+    a = np.concatenate([inizio + 1, singoli])
+    # segmenti tagliati sul bordo del raster: al massimo n_colonne + n_righe incroci ciascuno
+    u0, u1, v0, v1, dentro = taglia_segmenti(u[da], u[a], v[da], v[a], n_colonne, n_righe)
+    da, u0, u1, v0, v1 = da[dentro], u0[dentro], u1[dentro], v0[dentro], v1[dentro]
+
+    # parametro t (0-1 lungo il segmento) di ogni linea della griglia attraversata:
+    # tra due incroci consecutivi il segmento resta in una cella, quella del punto medio
+    n_segmenti = len(da)
+    segmento = [np.arange(n_segmenti), np.arange(n_segmenti)]
+    t = [np.zeros(n_segmenti), np.ones(n_segmenti)]
+    for p0, p1 in ((u0, u1), (v0, v1)):
+        c0 = np.floor(p0)
+        n_linee = np.abs(np.floor(p1) - c0).astype(np.int64)
+        s = np.repeat(np.arange(n_segmenti), n_linee)
+        k = np.arange(len(s)) - np.repeat(np.cumsum(n_linee) - n_linee, n_linee)
+        linea = np.where(p1[s] > p0[s], c0[s] + 1 + k, c0[s] - k)
+        segmento.append(s)
+        t.append((linea - p0[s]) / (p1[s] - p0[s]))
+    segmento = np.concatenate(segmento)
+    t = np.concatenate(t)
+    ordine = np.lexsort((t, segmento))
+    segmento, t = segmento[ordine], t[ordine]
+    stesso = segmento[1:] == segmento[:-1]
+    segmento = segmento[1:][stesso]
+    t = (t[1:][stesso] + t[:-1][stesso]) / 2
+
+    colonna = np.floor(u0[segmento] + t * (u1 - u0)[segmento])
+    riga = np.floor(v0[segmento] + t * (v1 - v0)[segmento])
+    dentro = (colonna >= 0) & (colonna < n_colonne) & (riga >= 0) & (riga < n_righe)
+    n_celle = conteggi.size
+    cella_piatta = riga[dentro].astype(np.int64) * n_colonne + colonna[dentro].astype(np.int64)
+
+    # una volta per (traccia, cella), poi tracce per cella
+    coppie = np.unique(traccia[da][segmento[dentro]] * n_celle + cella_piatta)
+    celle, n = np.unique(coppie % n_celle, return_counts=True)
+    conteggi.reshape(-1)[celle] += n.astype(np.int32)
+    return raster
+
+
+def densita_percorsi(percorsi_path=PERCORSI_DIR, cella_m=CELLA_M, righe_blocco=RIGHE_BLOCCO):
+    # Restituisce (raster, tracce lette, tracce malformate)
+    raster = raster_vuoto(cella_m)
+    trasformatore = Transformer.from_crs("EPSG:4326", CRS_METRICO, always_xy=True)
+    tracce = malformate = 0
+    for batch in apri_trip_store(percorsi_path).to_batches(columns=["PERCORSO"], batch_size=righe_blocco):
+        coordinate, offsets, malformati = tokenizza_percorsi(batch.column("PERCORSO").to_pandas())
+        x, y = trasformatore.transform(coordinate[:, 0], coordinate[:, 1])
+        brucia_tracce(raster, np.column_stack([x, y]), offsets)
+        tracce += len(offsets) - 1
+        malformate += int(malformati.sum())
+    return raster, tracce, malformate
+
+
+def salva_raster(raster, percorso=DENSITA_PATH):
+    # Sempre .npz (array + origine e passo della griglia). Con rasterio installato anche
+    # GeoTIFF, altrimenti griglia ASCII ESRI (.asc + .prj), leggibile da QGIS
+    np.savez_compressed(
+        f"{percorso}.npz",
+        conteggi=raster["conteggi"],
+        x_min=raster["x_min"],
+        y_max=raster["y_max"],
+        cella_m=raster["cella_m"],
+        crs=np.array(CRS_METRICO),
+    )
+    conteggi = raster["conteggi"]
+    cella = raster["cella_m"]
+    if rasterio is not None:
+        with rasterio.open(
+            f"{percorso}.tif", "w", driver="GTiff", height=conteggi.shape[0], width=conteggi.shape[1],
+            count=1, dtype="int32", crs=CRS_METRICO, compress="deflate",
+            transform=from_origin(raster["x_min"], raster["y_max"], cella, cella),
+        ) as tif:
+            tif.write(conteggi, 1)
+        return f"{percorso}.tif"
+
+    y_min = raster["y_max"] - conteggi.shape[0] * cella
+    intestazione = (
+        f"ncols {conteggi.shape[1]}\nnrows {conteggi.shape[0]}\n"
+        f"xllcorner {raster['x_min']}\nyllcorner {y_min}\ncellsize {cella}\nNODATA_value -1"
+    )
+    np.savetxt(f"{percorso}.asc", conteggi, fmt="%d", header=intestazione, comments="")
+    with open(f"{percorso}.prj", "w") as f:
+        f.write(CRS(CRS_METRICO).to_wkt("WKT1_ESRI"))
+    return f"{percorso}.asc"
+
+
+if __name__ == "__main__":
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import LogNorm
+
+    raster, tracce, malformate = densita_percorsi()
+    conteggi = raster["conteggi"]
+    print(f"Tracce elaborate: {tracce} (malformate, senza punti: {malformate})")
+    print(f"Griglia {conteggi.shape[1]} x {conteggi.shape[0]} celle da {CELLA_M} m, "
+          f"{int((conteggi > 0).sum()):,} celle attraversate, massimo {int(conteggi.max())} tracce per cella")
+    print(f"Raster salvato in {salva_raster(raster)}")
+
+    fig, ax = plt.subplots(figsize=(12, 12))
+    immagine = ax.imshow(
+        np.ma.masked_equal(conteggi, 0), cmap="inferno", norm=LogNorm(),
+        extent=(raster["x_min"], raster["x_min"] + conteggi.shape[1] * CELLA_M,
+                raster["y_max"] - conteggi.shape[0] * CELLA_M, raster["y_max"]),
+    )
+    plt.colorbar(immagine, ax=ax, label="Tracce per cella", shrink=0.7)
+    ax.set_title("Densità d'uso delle strade (tracce PERCORSO)", fontsize=16)
+    ax.set_axis_off()
+    plt.tight_layout()
+    plt.savefig("torino_densita_percorsi.png", dpi=200, bbox_inches="tight")
+    plt.show()
@@ -0,0 +1,99 @@
+import os
+import re
+import shutil
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from gestione_percorso import GEOMETRIE_DIR, PERCORSI_DIR
+from trip_store import apri_trip_store
+
+# Stessa grammatica accettata da ast.literal_eval in parse_geom: numeri anche senza cifra
+# intera (.5) o con segno +, coppie [lon, lat] o (lon, lat), terza coordinata (quota)
+# opzionale, scartata come farebbe una LineString 2D.
+# Senza lookahead: le stringhe pyarrow usano RE2, che valuta la regex in tempo lineare
+NUMERO = r"[-+]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?"
+PUNTO = rf"\s*{NUMERO}\s*,\s*{NUMERO}\s*(?:,\s*{NUMERO}\s*)?,?\s*"
+COPPIA = rf"(?:\[{PUNTO}\]|\({PUNTO}\))\s*"
+ELENCO = rf"\s*(?:{COPPIA}(?:,\s*{COPPIA})*,?\s*)?"
+# lista di coppie: l'unico contenuto accettato per la traccia
+LISTA_COPPIE = rf"\[{ELENCO}\]"
+# formato dict: {'type': 'LineString', 'coordinates': [...] o (...)}
+COORDINATES = r"""['"]coordinates['"]\s*:\s*(\[[^{}]*?[\])]\s*\]|\([^{}]*?[\])]\s*\)|\[\s*\]|\(\s*\))"""
+COORDINATE_DICT = rf"\[{ELENCO}\]|\({ELENCO}\)"
+# quota delle coppie 3D, tolta prima di leggere i numeri
+QUOTA = rf"({NUMERO}\s*,\s*{NUMERO})\s*,\s*{NUMERO}"
+NON_NUMERO = re.compile(r"[^0-9eE+.\-]+")
+
+
+def tokenizza_percorsi(testi):
+    # Tutte le tracce in blocco, senza literal_eval riga per riga.
+    # Restituisce (coordinate float64 n_punti x 2, offsets di lunghezza righe + 1,
+    # malformati): i punti della riga i sono coordinate[offsets[i]:offsets[i + 1]].
+    # Le righe vuote non sono malformate, hanno solo zero punti.
+    testi = pd.Series(testi, dtype="str").str.strip()
+    dizionario = testi.str.startswith("{", na=False)
+    corpo = testi.where(~dizionario, testi.str.extract(COORDINATES, expand=False))
+    validi = np.where(dizionario, corpo.str.fullmatch(COORDINATE_DICT).fillna(False),
+                      corpo.str.fullmatch(LISTA_COPPIE).fillna(False)).astype(bool)
+    malformati = ~validi & testi.notna().to_numpy()
+
+    # ogni coppia apre una parentesi oltre a quella esterna della lista
+    n_punti = np.where(validi, corpo.str.count(r"[\[(]").fillna(1).to_numpy() - 1, 0).astype(np.int64)
+    offsets = np.concatenate([[0], np.cumsum(n_punti)])
+
+    testo_unico = " ".join(corpo[validi].str.replace(QUOTA, r"\1", regex=True).tolist())
+    numeri = np.array(NON_NUMERO.sub(" ", testo_unico).split(), dtype=np.float64)
+    return numeri.reshape(-1, 2), offsets, malformati
+
+
+def costruisci_geometrie(coordinate, offsets):
+    # Una LineString per riga in una sola chiamata shapely (array "ragged");
+    # None per le righe con meno di 2 punti, come parse_geom
+    n_punti = np.diff(offsets)
+    linee = n_punti >= 2
+    geometrie = np.full(len(n_punti), None, dtype=object)
+    if linee.any():
+        tenuti = np.repeat(linee, n_punti)
+        indici = np.repeat(np.arange(linee.sum()), n_punti[linee])
+        geometrie[linee] = shapely.linestrings(coordinate[tenuti], indices=indici)
+    return geometrie
+
+
+def parse_percorsi(testi):
+    # restituisce (geometrie, malformati)
+    coordinate, offsets, malformati = tokenizza_percorsi(testi)
+    return costruisci_geometrie(coordinate, offsets), malformati
+
+
+def converti_percorsi(percorsi_path=PERCORSI_DIR, geometrie_path=GEOMETRIE_DIR, righe_batch=200_000):
+    # Legge il testo PERCORSO a blocchi dal dataset dei percorsi e scrive le geometrie.
+    # Restituisce (righe lette, righe malformate)
+    shutil.rmtree(geometrie_path, ignore_errors=True)
+    os.makedirs(geometrie_path)
+
+    righe = malformate = 0
+    batches = apri_trip_store(percorsi_path).to_batches(columns=["ID_CORSA", "PERCORSO"], batch_size=righe_batch)
+    for i, batch in enumerate(batches):
+        blocco = batch.to_pandas()
+        geometrie, malformati = parse_percorsi(blocco["PERCORSO"])
+        righe += len(blocco)
+        malformate += int(malformati.sum())
+
+        gdf = gpd.GeoDataFrame({"ID_CORSA": blocco["ID_CORSA"]}, geometry=geometrie, crs="EPSG:4326")
+        gdf.to_parquet(os.path.join(geometrie_path, f"parte-{i:05d}.parquet"), index=False)
+    return righe, malformate
+
+
+def carica_geometrie(id_corse=None, geometrie_path=GEOMETRIE_DIR):
+    # id_corse: se indicato, legge solo le tracce di quelle corse
+    if not os.path.exists(geometrie_path):
+        raise FileNotFoundError(
+            f"{geometrie_path} non trovato: eseguire prima ESERCIZIO 3/gestione_percorso.py"
+        )
+    filtro = None
+    if id_corse is not None:
+        filtro = [("ID_CORSA", "in", list(id_corse))]
+    return gpd.read_parquet(geometrie_path, filters=filtro)
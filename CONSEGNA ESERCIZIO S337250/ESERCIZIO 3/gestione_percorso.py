@@ -1,4 +1,6 @@
+import numpy as np
 import pandas as pd
+import shutil
 import sys
 from pathlib import Path
 
@@ -7,28 +9,58 @@ esercizio_1_path = root_dir / "ESERCIZIO 1"
 if str(esercizio_1_path) not in sys.path:
     sys.path.insert(0, str(esercizio_1_path))
 
-from unione import normalizza
+from ingest import CHUNK_SIZE, FILE_OPERATORI, prepara_blocco
+from schema import OPERATORI
+from trip_store import scrivi_trip_store
 
-df_a = normalizza(pd.read_csv("OPERATORE A/Corse_Torino_LIME.csv"), "LIME")
-df_b = normalizza(pd.read_csv("OPERATORE B/Corse_Torino_VOID.csv"), "VOID")
-df_c = normalizza(pd.read_csv("OPERATORE C/Corse_Torino_BIRD.csv"), "BIRD")
+# Ogni riga grezza dei CSV operatore è divisa in due tabelle Parquet con la stessa chiave ID_CORSA:
+# - attributi: colonne normalizzate (schema compatto, date già convertite), senza PERCORSO
+# - percorsi: solo ID_CORSA, OPERATORE, DATAORA_INIZIO (per le partizioni) e il testo PERCORSO,
+#   compresso su disco, da leggere solo quando servono le tracce
+ATTRIBUTI_DIR = "Corse_Torino_ATTRIBUTI_parquet"
+PERCORSI_DIR = "Corse_Torino_PERCORSO_parquet"
 
-data_all = pd.concat([df_a, df_b, df_c], ignore_index=True)
-data_all=data_all.drop(columns=["ID_ORGANIZZAZIONE"], errors="ignore")
+# geometrie ricavate dai percorsi (geometrie_percorso.converti_percorsi), stessa chiave
+GEOMETRIE_DIR = "Corse_Torino_PERCORSO_geoparquet"
 
-def estrai_percorso(df_raw, operatore):
-    if "PERCORSO" not in df_raw.columns:
-        return pd.DataFrame()
-    return df_raw[["ID_VEICOLO", "DATAORA_INIZIO", "DATAORA_FINE", "PERCORSO"]].assign(OPERATORE=operatore)
 
-percorso_a = estrai_percorso(pd.read_csv("OPERATORE A/Corse_Torino_LIME.csv"), "LIME")
-percorso_b = estrai_percorso(pd.read_csv("OPERATORE B/Corse_Torino_VOID.csv"), "VOID")
-percorso_c = estrai_percorso(pd.read_csv("OPERATORE C/Corse_Torino_BIRD.csv"), "BIRD")
+def dividi_blocco(df_raw, operatore, primo_id):
+    # ID_CORSA progressivo nell'ordine di lettura (operatore, riga del file)
+    df_raw = df_raw.assign(ID_CORSA=np.arange(primo_id, primo_id + len(df_raw), dtype=np.int64))
 
-percorso_all = pd.concat([percorso_a, percorso_b, percorso_c], ignore_index=True)
-percorso_all.to_csv("Corse_Torino_PERCORSO.csv", index=False)
+    attributi = prepara_blocco(df_raw.drop(columns=["PERCORSO"], errors="ignore"), operatore)
+    attributi = attributi.assign(ID_CORSA=df_raw["ID_CORSA"].to_numpy())
 
+    # sempre stringa: un blocco con PERCORSO tutto vuoto verrebbe letto come float
+    testo = df_raw["PERCORSO"] if "PERCORSO" in df_raw.columns else pd.Series(None, index=df_raw.index)
+    percorsi = attributi[["ID_CORSA", "OPERATORE", "DATAORA_INIZIO"]].assign(
+        PERCORSO=pd.Series(testo.to_numpy(), index=attributi.index, dtype="str")
+    )
+    return attributi, percorsi
 
-print(data_all.head())
-print(data_all.info())
-print(data_all.columns)
\ No newline at end of file
+
+def dividi_corse(chunksize=CHUNK_SIZE, attributi_path=ATTRIBUTI_DIR, percorsi_path=PERCORSI_DIR):
+    # Una sola lettura di ogni CSV, a blocchi: la colonna PERCORSO (la più pesante)
+    # passa una volta sola dal parser CSV e va direttamente nella tabella dei percorsi
+    shutil.rmtree(attributi_path, ignore_errors=True)
+    shutil.rmtree(percorsi_path, ignore_errors=True)
+    # le geometrie derivate dai vecchi percorsi non sono più valide
+    shutil.rmtree(GEOMETRIE_DIR, ignore_errors=True)
+
+    righe = {operatore: 0 for operatore in OPERATORI}
+    prossimo_id = 0
+    for operatore, percorso in FILE_OPERATORI.items():
+        for blocco in pd.read_csv(percorso, chunksize=chunksize):
+            attributi, percorsi = dividi_blocco(blocco, operatore, prossimo_id)
+            prossimo_id += len(blocco)
+            righe[operatore] += len(blocco)
+            scrivi_trip_store(attributi, attributi_path, aggiungi=True)
+            scrivi_trip_store(percorsi, percorsi_path, aggiungi=True)
+    return righe
+
+
+if __name__ == "__main__":
+    righe = dividi_corse()
+    for operatore, n in righe.items():
+        print(f"{operatore}: {n} corse")
+    print(f"Attributi scritti in {ATTRIBUTI_DIR}, percorsi in {PERCORSI_DIR} (chiave ID_CORSA)")
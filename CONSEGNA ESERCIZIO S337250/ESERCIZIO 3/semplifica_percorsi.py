@@ -0,0 +1,168 @@
+import os
+import shutil
+import sys
+from contextlib import ExitStack
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import shapely
+from pyproj import Transformer
+
+root_dir = Path(__file__).resolve().parent.parent
+esercizio_1_path = root_dir / "ESERCIZIO 1"
+if str(esercizio_1_path) not in sys.path:
+    sys.path.insert(0, str(esercizio_1_path))
+
+from gestione_percorso import GEOMETRIE_DIR
+from geometrie_percorso import converti_percorsi, costruisci_geometrie
+from trip_store import apri_trip_store
+
+# Tracce semplificate per mappe e analisi, a più livelli di tolleranza.
+# Douglas-Peucker (shapely.simplify, una chiamata per blocco) in EPSG:32632, poi coordinate
+# quantizzate a QUANTO_M e salvate come interi: primo punto di ogni traccia assoluto, gli
+# altri come differenza dal punto precedente (numeri piccoli, che si comprimono bene).
+# Un Parquet per livello, una riga per traccia: ID_CORSA e le liste int32 DX / DY dei suoi
+# punti (il passo di quantizzazione è nei metadati dello schema). Ogni blocco di tracce è
+# scritto come row group appena semplificato, e la lettura filtra ID_CORSA nel Parquet,
+# quindi si decodificano solo le tracce richieste.
+# Lo scarto dalla traccia originale è al massimo tolleranza + QUANTO_M / √2;
+# quello misurato (distanza di Hausdorff) è riportato per ogni livello.
+SEMPLIFICATI_DIR = "Corse_Torino_PERCORSO_semplificato"
+TOLLERANZE_M = (1, 5, 10, 25)
+QUANTO_M = 0.5
+RIGHE_BLOCCO = 50_000
+# differenze intere quasi tutte diverse: il dizionario non aiuta, zstd sì
+OPZIONI_PARQUET = {"compression": "zstd", "compression_level": 9, "use_dictionary": False}
+CRS_METRICO = "EPSG:32632"
+
+
+def percorso_livello(tolleranza, output_path=SEMPLIFICATI_DIR):
+    return os.path.join(output_path, f"tolleranza_{tolleranza}m.parquet")
+
+
+def schema_livello(tipo_id, quanto=QUANTO_M):
+    return pa.schema(
+        [("ID_CORSA", tipo_id), ("DX", pa.list_(pa.int32())), ("DY", pa.list_(pa.int32()))],
+        metadata={"quanto": str(quanto)},
+    )
+
+
+def in_metri(geometrie, trasformatore):
+    # LineString EPSG:4326 -> stesse linee in EPSG:32632 (coordinate trasformate in blocco)
+    return shapely.transform(geometrie, lambda xy: np.column_stack(trasformatore.transform(xy[:, 0], xy[:, 1])))
+
+
+def codifica(geometrie, quanto=QUANTO_M):
+    # geometrie (metriche) -> offsets, dx, dy: coordinate intere a passo `quanto`, in differenze
+    coordinate, traccia = shapely.get_coordinates(geometrie, return_index=True)
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(traccia, minlength=len(geometrie)))])
+    interi = np.round(coordinate / quanto).astype(np.int64)
+    delta = np.diff(interi, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+    # il primo punto di ogni traccia resta assoluto
+    inizi = offsets[:-1][np.diff(offsets) > 0]
+    delta[inizi] = interi[inizi]
+    return offsets, delta[:, 0].astype(np.int32), delta[:, 1].astype(np.int32)
+
+
+def decodifica(offsets, dx, dy, quanto=QUANTO_M):
+    # inverso di codifica: coordinate metriche float64 (n_punti x 2)
+    somma = np.cumsum(np.column_stack([dx, dy]).astype(np.int64), axis=0)
+    n_punti = np.diff(offsets)
+    # somma cumulata fino al punto prima dell'inizio di ogni traccia
+    base = np.zeros((len(n_punti), 2), dtype=np.int64)
+    inizi = offsets[:-1]
+    base[inizi > 0] = somma[inizi[inizi > 0] - 1]
+    return (somma - np.repeat(base, n_punti, axis=0)) * quanto
+
+
+def semplifica_percorsi(geometrie_path=GEOMETRIE_DIR, output_path=SEMPLIFICATI_DIR,
+                        tolleranze=TOLLERANZE_M, quanto=QUANTO_M):
+    # Scrive un file per livello, un row group per blocco, e restituisce il resoconto per
+    # livello (punti, MB su disco, scarto misurato e limite teorico in metri)
+    if not os.path.exists(geometrie_path):
+        raise FileNotFoundError(
+            f"{geometrie_path} non trovato: eseguire prima ESERCIZIO 3/gestione_percorso.py"
+        )
+    shutil.rmtree(output_path, ignore_errors=True)
+    os.makedirs(output_path)
+    trasformatore = Transformer.from_crs("EPSG:4326", CRS_METRICO, always_xy=True)
+
+    dataset = apri_trip_store(geometrie_path)
+    schema = schema_livello(dataset.schema.field("ID_CORSA").type, quanto)
+    # per livello restano in memoria solo i contatori e uno scarto per traccia
+    punti = dict.fromkeys(tolleranze, 0)
+    scarti = {t: [] for t in tolleranze}
+    punti_originali = 0
+    with ExitStack() as pila:
+        scrittori = {
+            t: pila.enter_context(pq.ParquetWriter(percorso_livello(t, output_path), schema, **OPZIONI_PARQUET))
+            for t in tolleranze
+        }
+        for batch in dataset.to_batches(columns=["ID_CORSA", "geometry"], batch_size=RIGHE_BLOCCO):
+            originali = in_metri(shapely.from_wkb(batch.column("geometry").to_numpy(zero_copy_only=False)), trasformatore)
+            punti_originali += int(shapely.get_num_coordinates(originali).sum())
+            for tolleranza, scrittore in scrittori.items():
+                offsets, dx, dy = codifica(shapely.simplify(originali, tolleranza, preserve_topology=False), quanto)
+                # scarto misurato sulla traccia ricostruita (semplificazione + quantizzazione)
+                ricostruite = costruisci_geometrie(decodifica(offsets, dx, dy, quanto), offsets)
+                scarti[tolleranza].append(shapely.hausdorff_distance(originali, ricostruite))
+                punti[tolleranza] += int(offsets[-1])
+                offsets = pa.array(offsets, type=pa.int32())
+                scrittore.write_table(pa.table({
+                    "ID_CORSA": batch.column("ID_CORSA"),
+                    "DX": pa.ListArray.from_arrays(offsets, pa.array(dx)),
+                    "DY": pa.ListArray.from_arrays(offsets, pa.array(dy)),
+                }, schema=schema))
+
+    resoconto = []
+    for tolleranza in tolleranze:
+        scarto = np.concatenate(scarti[tolleranza]) if scarti[tolleranza] else np.array([])
+        scarto = scarto[np.isfinite(scarto)]
+        resoconto.append({
+            "TOLLERANZA_M": tolleranza,
+            "PUNTI": punti[tolleranza],
+            "QUOTA_PUNTI": punti[tolleranza] / max(punti_originali, 1),
+            "MB": os.path.getsize(percorso_livello(tolleranza, output_path)) / 1e6,
+            "SCARTO_MAX_M": scarto.max() if len(scarto) else 0.0,
+            "SCARTO_P95_M": np.percentile(scarto, 95) if len(scarto) else 0.0,
+            "LIMITE_M": tolleranza + quanto / np.sqrt(2),
+        })
+    return pd.DataFrame(resoconto), punti_originali
+
+
+def carica_percorsi_semplificati(tolleranza, id_corse=None, output_path=SEMPLIFICATI_DIR, crs="EPSG:4326"):
+    # GeoDataFrame ID_CORSA + LineString del livello richiesto (None per tracce < 2 punti)
+    # id_corse: se indicato, legge e decodifica solo le tracce di quelle corse
+    percorso = percorso_livello(tolleranza, output_path)
+    if not os.path.exists(percorso):
+        raise FileNotFoundError(
+            f"{percorso} non trovato: eseguire prima ESERCIZIO 3/semplifica_percorsi.py"
+        )
+    filtro = None
+    if id_corse is not None:
+        filtro = [("ID_CORSA", "in", list(id_corse))]
+    tabella = pq.read_table(percorso, filters=filtro)
+    quanto = float(tabella.schema.metadata[b"quanto"])
+
+    dx, dy = tabella.column("DX").combine_chunks(), tabella.column("DY").combine_chunks()
+    offsets = np.concatenate([[0], np.cumsum(pc.list_value_length(dx).to_numpy())]).astype(np.int64)
+    coordinate = decodifica(offsets, dx.flatten().to_numpy(), dy.flatten().to_numpy(), quanto)
+    geometrie = costruisci_geometrie(coordinate, offsets)
+    gdf = gpd.GeoDataFrame({"ID_CORSA": tabella.column("ID_CORSA").to_numpy()}, geometry=geometrie, crs=CRS_METRICO)
+    return gdf.to_crs(crs) if crs != CRS_METRICO else gdf
+
+
+if __name__ == "__main__":
+    if not os.path.exists(GEOMETRIE_DIR):
+        righe, malformate = converti_percorsi()
+        print(f"Percorsi convertiti: {righe} (malformati, senza geometria: {malformate})")
+    resoconto, punti_originali = semplifica_percorsi()
+    originale_mb = sum(f.stat().st_size for f in Path(GEOMETRIE_DIR).glob("*.parquet")) / 1e6
+    print(f"Tracce originali: {punti_originali:,} punti, {originale_mb:.1f} MB ({GEOMETRIE_DIR})")
+    print(resoconto.round(3).to_string(index=False))
+    print(f"Livelli salvati in {SEMPLIFICATI_DIR}")
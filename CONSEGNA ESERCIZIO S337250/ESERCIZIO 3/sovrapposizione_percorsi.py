@@ -0,0 +1,166 @@
+import os
+import shutil
+import sys
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from pyproj import Transformer
+from scipy.spatial import cKDTree
+
+root_dir = Path(__file__).resolve().parent.parent
+esercizio_1_path = root_dir / "ESERCIZIO 1"
+if str(esercizio_1_path) not in sys.path:
+    sys.path.insert(0, str(esercizio_1_path))
+if str(root_dir) not in sys.path:
+    sys.path.insert(0, str(root_dir))
+
+from gestione_percorso import GEOMETRIE_DIR
+from geometrie_percorso import converti_percorsi
+from trip_store import apri_trip_store
+from zones import GRID_BOUNDS
+
+# Quota di ogni traccia PERCORSO che corre dentro i corridoi del trasporto pubblico.
+# stops.geojson non contiene la forma delle linee né l'ordine delle fermate, quindi il
+# corridoio è l'insieme dei punti a meno di CORRIDOIO_M da una fermata GTT.
+# Ogni segmento della traccia (in EPSG:32632) è campionato ogni PASSO_M metri e la distanza
+# dalla fermata più vicina di ogni campione viene da un KD-tree sulle fermate: la lunghezza
+# dentro il corridoio è la somma dei tratti con il campione entro CORRIDOIO_M.
+# I punti non finiti o più lontani di MARGINE_M dal riquadro del filtro di pulizia
+# (zones.GRID_BOUNDS) sono errori GPS (es. un punto a 0,0): la traccia è spezzata lì.
+# Le tracce sono elaborate a blocchi su più processi; il risultato, una riga per corsa
+# (ID_CORSA), è salvato in Parquet e copre tutti i giorni, non solo i giorni tipo.
+# In memoria restano al più BLOCCHI_PER_WORKER blocchi per processo: i blocchi sono letti
+# dal dataset delle geometrie man mano che i precedenti finiscono.
+FERMATE_PATH = "gtt_gtfs/stops.geojson"
+SOVRAPPOSIZIONE_DIR = "Corse_Torino_SOVRAPPOSIZIONE_parquet"
+
+CORRIDOIO_M = 300
+PASSO_M = 10
+MARGINE_M = 5_000
+RIGHE_BLOCCO = 20_000
+BLOCCHI_PER_WORKER = 2
+CRS_METRICO = "EPSG:32632"
+
+# stato dei worker: KD-tree delle fermate, costruito una volta per processo
+_albero_fermate = None
+_trasformatore = None
+_riquadro = None
+
+
+def coordinate_fermate(fermate_path=FERMATE_PATH):
+    fermate = gpd.read_file(fermate_path).to_crs(CRS_METRICO)
+    return np.column_stack([fermate.geometry.x, fermate.geometry.y])
+
+
+def inizializza_worker(xy_fermate, margine_m=MARGINE_M):
+    global _albero_fermate, _trasformatore, _riquadro
+    _albero_fermate = cKDTree(xy_fermate)
+    _trasformatore = Transformer.from_crs("EPSG:4326", CRS_METRICO, always_xy=True)
+    x_min, y_min, x_max, y_max = _trasformatore.transform_bounds(*GRID_BOUNDS)
+    _riquadro = (x_min - margine_m, y_min - margine_m, x_max + margine_m, y_max + margine_m)
+
+
+def misura_blocco(id_corse, wkb, corridoio_m=CORRIDOIO_M, passo_m=PASSO_M):
+    # id_corse / wkb: ID_CORSA e geometrie WKB (EPSG:4326) di un blocco di tracce.
+    # Restituisce un DataFrame ID_CORSA, LUNGHEZZA_M, LUNGHEZZA_CORRIDOIO_M, QUOTA_CORRIDOIO
+    geometrie = shapely.from_wkb(wkb)
+    coordinate, traccia = shapely.get_coordinates(geometrie, return_index=True)
+    x, y = _trasformatore.transform(coordinate[:, 0], coordinate[:, 1])
+
+    # segmenti tra vertici consecutivi della stessa traccia, entrambi finiti e nel riquadro:
+    # niente segmenti verso un punto errato, quindi niente milioni di campioni per segmento
+    x_min, y_min, x_max, y_max = _riquadro
+    buono = np.isfinite(x) & np.isfinite(y) & (x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max)
+    stessa = (traccia[1:] == traccia[:-1]) & buono[1:] & buono[:-1]
+    x0, y0, x1, y1 = x[:-1][stessa], y[:-1][stessa], x[1:][stessa], y[1:][stessa]
+    segmento_traccia = traccia[1:][stessa]
+    lunghezza = np.hypot(x1 - x0, y1 - y0)
+
+    # campioni al centro di ogni tratto di passo_m (almeno uno per segmento)
+    n_tratti = np.maximum(np.ceil(lunghezza / passo_m).astype(np.int64), 1)
+    segmento = np.repeat(np.arange(len(lunghezza)), n_tratti)
+    inizio_tratti = np.cumsum(n_tratti) - n_tratti
+    t = (np.arange(len(segmento)) - inizio_tratti[segmento] + 0.5) / n_tratti[segmento]
+    distanza, _ = _albero_fermate.query(
+        np.column_stack([x0[segmento] + t * (x1 - x0)[segmento], y0[segmento] + t * (y1 - y0)[segmento]]),
+        distance_upper_bound=corridoio_m,
+    )
+    dentro = (lunghezza[segmento] / n_tratti[segmento]) * (distanza <= corridoio_m)
+
+    n = len(id_corse)
+    totale = np.bincount(segmento_traccia, weights=lunghezza, minlength=n)
+    nel_corridoio = np.bincount(segmento_traccia[segmento], weights=dentro, minlength=n)
+    # tracce senza geometria (o di un solo punto): quota non definita
+    quota = np.divide(nel_corridoio, totale, out=np.full(n, np.nan), where=totale > 0)
+    return pd.DataFrame({
+        "ID_CORSA": id_corse,
+        "LUNGHEZZA_M": totale,
+        "LUNGHEZZA_CORRIDOIO_M": nel_corridoio,
+        "QUOTA_CORRIDOIO": quota,
+    })
+
+
+def blocchi_tracce(geometrie_path=GEOMETRIE_DIR, righe_blocco=RIGHE_BLOCCO):
+    if not os.path.exists(geometrie_path):
+        raise FileNotFoundError(
+            f"{geometrie_path} non trovato: eseguire prima ESERCIZIO 3/gestione_percorso.py"
+        )
+    for batch in apri_trip_store(geometrie_path).to_batches(columns=["ID_CORSA", "geometry"], batch_size=righe_blocco):
+        yield (batch.column("ID_CORSA").to_numpy(),
+               batch.column("geometry").to_numpy(zero_copy_only=False))
+
+
+def scrivi_completati(in_volo, output_path, attesa):
+    # in_volo: future -> indice del blocco. Attende i blocchi (FIRST_COMPLETED: almeno uno),
+    # scrive ognuno nella sua parte e lo toglie da in_volo. Restituisce le righe scritte
+    completati, _ = wait(in_volo, return_when=attesa)
+    righe = 0
+    for futuro in completati:
+        risultato = futuro.result()
+        risultato.to_parquet(os.path.join(output_path, f"parte-{in_volo.pop(futuro):05d}.parquet"), index=False)
+        righe += len(risultato)
+    return righe
+
+
+def misura_sovrapposizione(geometrie_path=GEOMETRIE_DIR, output_path=SOVRAPPOSIZIONE_DIR,
+                           fermate_path=FERMATE_PATH, max_workers=None):
+    # Blocchi di RIGHE_BLOCCO tracce su più processi, ognuno scritto appena finisce; le parti
+    # prendono il nome dall'indice del blocco, quindi la lettura segue l'ordine dei blocchi.
+    # Restituisce il numero di tracce misurate
+    shutil.rmtree(output_path, ignore_errors=True)
+    os.makedirs(output_path)
+
+    xy_fermate = coordinate_fermate(fermate_path)
+    limite = BLOCCHI_PER_WORKER * (max_workers or os.cpu_count() or 1)
+    in_volo = {}
+    righe = 0
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=inizializza_worker,
+                             initargs=(xy_fermate,)) as executor:
+        for i, blocco in enumerate(blocchi_tracce(geometrie_path)):
+            if len(in_volo) >= limite:
+                righe += scrivi_completati(in_volo, output_path, FIRST_COMPLETED)
+            in_volo[executor.submit(misura_blocco, *blocco)] = i
+        righe += scrivi_completati(in_volo, output_path, ALL_COMPLETED)
+    return righe
+
+
+def carica_sovrapposizione(output_path=SOVRAPPOSIZIONE_DIR):
+    if not os.path.exists(output_path):
+        raise FileNotFoundError(
+            f"{output_path} non trovato: eseguire prima ESERCIZIO 3/sovrapposizione_percorsi.py"
+        )
+    return pd.read_parquet(output_path)
+
+
+# protetto: i worker re-importano questo file (avvio "spawn" su Windows/macOS)
+if __name__ == "__main__":
+    if not os.path.exists(GEOMETRIE_DIR):
+        righe, malformate = converti_percorsi()
+        print(f"Percorsi convertiti: {righe} (malformati, senza geometria: {malformate})")
+    righe = misura_sovrapposizione()
+    print(f"Tracce misurate: {righe} (corridoio {CORRIDOIO_M} m, campioni ogni {PASSO_M} m)")
+    print(f"Quote per corsa salvate in {SOVRAPPOSIZIONE_DIR}")
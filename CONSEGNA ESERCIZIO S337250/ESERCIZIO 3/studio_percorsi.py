@@ -1,11 +1,25 @@
 import pandas as pd
 import geopandas as gpd
-from shapely.geometry import LineString
-import ast
-
-# 1. Caricamento Dati
-print("1. Caricamento CSV...")
-df = pd.read_csv('Corse_Torino_PERCORSO.csv')
+import os
+import sys
+from pathlib import Path
+
+root_dir = Path(__file__).resolve().parent.parent
+esercizio_1_path = root_dir / "ESERCIZIO 1"
+if str(esercizio_1_path) not in sys.path:
+    sys.path.insert(0, str(esercizio_1_path))
+
+from gestione_percorso import ATTRIBUTI_DIR, GEOMETRIE_DIR, PERCORSI_DIR
+from geometrie_percorso import carica_geometrie, converti_percorsi
+from semplifica_percorsi import SEMPLIFICATI_DIR, carica_percorsi_semplificati
+from sovrapposizione_percorsi import CORRIDOIO_M, SOVRAPPOSIZIONE_DIR, carica_sovrapposizione
+from trip_store import carica_corse
+
+# 1. Caricamento Dati (tabelle scritte da gestione_percorso.py, unite sulla chiave ID_CORSA)
+print("1. Caricamento attributi e percorsi...")
+attributi = carica_corse(colonne=["ID_CORSA", "ID_VEICOLO", "OPERATORE", "DATAORA_INIZIO"], percorso=ATTRIBUTI_DIR)
+percorsi = carica_corse(colonne=["ID_CORSA", "PERCORSO"], percorso=PERCORSI_DIR)
+df = attributi.merge(percorsi, on="ID_CORSA")
 
 # Drop rows where percorso is outside Torino area
 print("Filtraggio righe fuori dall'area di Torino...")
@@ -15,11 +29,28 @@ print(f"{len(df)} righe dopo il filtraggio per l'area di Torino.")
 
 # 2. Pre-processing Date
 print("2. Elaborazione temporale...")
-df['DATAORA_INIZIO'] = pd.to_datetime(df['DATAORA_INIZIO'], format='mixed')
+# DATAORA_INIZIO è già datetime (convertita una volta sola in gestione_percorso.py)
 df['DATE'] = df['DATAORA_INIZIO'].dt.date  # Solo la data (es. 2024-01-15)
 df['MONTH'] = df['DATAORA_INIZIO'].dt.month
 df['WEEKDAY'] = df['DATAORA_INIZIO'].dt.dayofweek # 0=Lun, 6=Dom
 
+# Sovrapposizione con i corridoi del trasporto pubblico, su tutte le corse
+# (quote per corsa calcolate da sovrapposizione_percorsi.py)
+SOGLIA_COMPETIZIONE = 0.5
+if os.path.exists(SOVRAPPOSIZIONE_DIR):
+    df = df.merge(carica_sovrapposizione()[['ID_CORSA', 'QUOTA_CORRIDOIO']], on='ID_CORSA', how='left')
+    # competitiva: almeno metà della traccia dentro i corridoi delle fermate
+    df['COMPETITIVA'] = df['QUOTA_CORRIDOIO'] >= SOGLIA_COMPETIZIONE
+    misurate = df[df['QUOTA_CORRIDOIO'].notna()]
+    print(f"\nQuota di percorso entro {CORRIDOIO_M} m da una fermata (tutte le corse):")
+    print(misurate.groupby(['MONTH', 'OPERATORE'], observed=True).agg(
+        CORSE=('ID_CORSA', 'size'),
+        QUOTA_MEDIA=('QUOTA_CORRIDOIO', 'mean'),
+        COMPETITIVE=('COMPETITIVA', 'mean'),
+    ).round(3))
+else:
+    print(f"{SOVRAPPOSIZIONE_DIR} non trovato: eseguire ESERCIZIO 3/sovrapposizione_percorsi.py per la sovrapposizione")
+
 # -------------------------------------------------------------------------
 # ALGORITMO DI SELEZIONE DEL "GIORNO TIPO" (Metodo FHWA/AWT simplified)
 # -------------------------------------------------------------------------
@@ -66,28 +97,32 @@ for index, row in monthly_means.iterrows():
 print(f"\n4. Filtraggio dataset su {len(selected_dates)} giorni rappresentativi...")
 df_final = df[df['DATE'].isin(selected_dates)].copy()
 
-# 4. Parsing Geometria (Funzione Robusta)
-def parse_geom(geom_str):
-    try:
-        if pd.isna(geom_str): return None
-        data = ast.literal_eval(geom_str)
-        if isinstance(data, dict): coords = data.get('coordinates', [])
-        elif isinstance(data, list): coords = data
-        else: return None
-        
-        if len(coords) >= 2: return LineString(coords)
-    except: return None
-
+# 4. Geometrie: il testo PERCORSO viene convertito una volta sola (formato dict con
+# 'coordinates' o lista di coppie) e salvato in GeoParquet; le esecuzioni successive
+# leggono solo le tracce dei giorni selezionati.
+# Se semplifica_percorsi.py è stato eseguito, nel GeoPackage vanno le tracce semplificate
+# (scarto massimo ~TOLLERANZA_GPKG_M metri), molto più leggere
+TOLLERANZA_GPKG_M = 5
 print("5. Generazione geometrie...")
-df_final['geometry'] = df_final['PERCORSO'].apply(parse_geom)
+if not os.path.exists(GEOMETRIE_DIR):
+    righe, malformate = converti_percorsi()
+    print(f"Percorsi convertiti: {righe} (malformati, senza geometria: {malformate})")
+if os.path.exists(SEMPLIFICATI_DIR):
+    geometrie = carica_percorsi_semplificati(TOLLERANZA_GPKG_M, df_final['ID_CORSA'])
+else:
+    geometrie = carica_geometrie(df_final['ID_CORSA'])
+df_final = df_final.merge(pd.DataFrame(geometrie[['ID_CORSA', 'geometry']]), on='ID_CORSA')
 df_final = df_final.dropna(subset=['geometry'])
 
 # 5. Salvataggio GeoPackage
 # Aggiungiamo una colonna stringa per la data per facilitare l'uso in QGIS
 df_final['DATA_RIF'] = df_final['DATE'].astype(str)
 
+colonne = ['ID_VEICOLO', 'OPERATORE', 'MONTH', 'DATA_RIF']
+if 'QUOTA_CORRIDOIO' in df_final.columns:
+    colonne.append('QUOTA_CORRIDOIO')
 gdf = gpd.GeoDataFrame(
-    df_final[['ID_VEICOLO', 'OPERATORE', 'MONTH', 'DATA_RIF', 'geometry']], 
+    df_final[colonne + ['geometry']], 
     geometry='geometry', 
     crs="EPSG:4326"
 )
@@ -1,15 +1,25 @@
+import sys
+from pathlib import Path
+
 import pandas as pd
 import numpy as np
 
+root_dir = Path(__file__).resolve().parent.parent
+esercizio_1_path = root_dir / "ESERCIZIO 1"
+if str(esercizio_1_path) not in sys.path:
+    sys.path.insert(0, str(esercizio_1_path))
+
+from trip_store import carica_corse
+
 # =========================
 # 1. LOAD TRIPS
 # =========================
-TRIPS_FILE = "Corse_Torino_TUTTI.csv"  
-df = pd.read_csv(TRIPS_FILE)
-
-# Keep only Lime, Bird, Voi
+# Keep only Lime, Bird, Voi (partition filter: other operators are never read)
 target_ops = ["LIME", "BIRD", "VOID"]
-df = df[df["OPERATORE"].isin(target_ops)].copy()
+df = carica_corse(
+    colonne=["OPERATORE", "DURATA_MIN", "DISTANZA_KM"],
+    operatori=target_ops,
+)
 
 # =========================
 # 2. REVENUE (TARIFFS)
@@ -1,31 +1,34 @@
+import sys
+from pathlib import Path
+
 import pandas as pd
 import geopandas as gpd
 import matplotlib.pyplot as plt
 import seaborn as sns
-from shapely import wkt
-from shapely.geometry import Point
+
+root_dir = Path(__file__).resolve().parent.parent
+esercizio_1_path = root_dir / "ESERCIZIO 1"
+if str(esercizio_1_path) not in sys.path:
+    sys.path.insert(0, str(esercizio_1_path))
+if str(root_dir) not in sys.path:
+    sys.path.insert(0, str(root_dir))
+
+from trip_store import carica_corse
+from zones import load_zones, zone_names
 
 # ---------------------------------------------------------
 # 1. LOAD AND PREPARE DATA
 # ---------------------------------------------------------
 print("1. Loading Data...")
-ZONES_FILE= "zone_statistiche_csv/zone_statistiche.csv" 
 
 # A. Load Scooter Data
-df = pd.read_csv("Corse_Torino_TUTTI.csv")
-df['DATAORA_INIZIO'] = pd.to_datetime(df['DATAORA_INIZIO'])
-df['DATAORA_FINE'] = pd.to_datetime(df['DATAORA_FINE'])
-
-# B. Load Zones (Map)
-try:
-    zones_df = pd.read_csv(ZONES_FILE, sep=';', encoding='latin1')
-except:
-    zones_df = pd.read_csv(ZONES_FILE, sep=';', encoding='cp1252')
+df = carica_corse(colonne=[
+    'ID_VEICOLO', 'DATAORA_INIZIO', 'DATAORA_FINE', 'ORIGIN_ZONE',
+])
 
-zones_df['geometry'] = zones_df['WKT_GEOM'].apply(wkt.loads)
-zones_gdf = gpd.GeoDataFrame(zones_df, geometry='geometry')
-zones_gdf.set_crs(epsg=3003, inplace=True)
-zones_gdf = zones_gdf.to_crs(epsg=4326)
+# B. Load Zones (Map, cached in EPSG:4326)
+zone_data = load_zones()
+zones_gdf = zone_data.geo
 
 # ---------------------------------------------------------
 # 2. CALCULATE PARKING DURATION
@@ -60,13 +63,13 @@ print(f"   Average Parking Duration: {df_parking['PARKING_MINUTES'].mean():.2f}
 # ---------------------------------------------------------
 print("3. Mapping Parking to Zones...")
 
-# where the scooter was parked.
-geometry_points = [Point(xy) for xy in zip(df_parking.LONGITUTIDE_INIZIO_CORSA, df_parking.LATITUDINE_INIZIO_CORSA)]
-gdf_points = gpd.GeoDataFrame(df_parking, geometry=geometry_points, crs="EPSG:4326")
+# Zone of the point where the scooter was parked = origin zone of the next trip,
+# assigned when the trip store is written (-1 = outside the map)
+zone_code = df_parking['ORIGIN_ZONE'].to_numpy()
 
-# Join with Zones
-# Using 'DENOM' for the zone name
-gdf_joined = gpd.sjoin(gdf_points, zones_gdf[['DENOM', 'geometry']], how="inner", predicate="within")
+# Keep parking events inside a zone, using 'DENOM' for the zone name
+inside = zone_code >= 0
+gdf_joined = df_parking[inside].assign(DENOM=zone_names(zone_data, zone_code[inside]))
 
 # ---------------------------------------------------------
 # 4. AGGREGATE STATS PER ZONE
@@ -1,25 +1,41 @@
+import sys
+from pathlib import Path
 
-
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 import matplotlib.pyplot as plt
-from shapely import wkt
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+root_dir = Path(__file__).resolve().parent
+esercizio_1_path = root_dir / "ESERCIZIO 1"
+if str(esercizio_1_path) not in sys.path:
+    sys.path.insert(0, str(esercizio_1_path))
+
+from hexgrid import HEX_SIZES_M, HexPyramid, hex_polygons
+from od_cube import TIME_BANDS
+from trip_store import carica_corse
+from zones import load_zones
 
 # ----------------------------
 # 0) Paths and parameters
 # ----------------------------
-try:
-    zones_df = pd.read_csv("zone_statistiche_csv/zone_statistiche.csv", sep=';', encoding='latin1')
-except:
-    zones_df = pd.read_csv("zone_statistiche_csv/zone_statistiche.csv", sep=',', encoding='latin1')
-
-zones_df['geometry'] = zones_df['WKT_GEOM'].apply(wkt.loads)
-zones_gdf = gpd.GeoDataFrame(zones_df, geometry='geometry')
-zones_gdf.set_crs(epsg=3003, inplace=True)
-zones_gdf = zones_gdf.to_crs(epsg=4326)
+# zones already parsed and reprojected (EPSG:4326 and EPSG:32632), see zones.py
+zone_data = load_zones()
+zones_gdf = zone_data.geo
 
 BUFFER_M = 300
 
+# Radius sensitivity: the four classes for every radius, in one pass over the distances
+SWEEP_RADII_M = list(range(50, 1050, 50))
+sweep_path = "transit_buffer_sweep.csv"
+
+# Stop-level first/last-mile flows: endpoints snapped to the nearest stop within SNAP_RADIUS_M
+SNAP_RADIUS_M = BUFFER_M
+stop_flows_path = "transit_stop_zone_flows.npz"
+route_flows_path = "transit_route_feeders.csv"
+
 CRS_TRIPS = "EPSG:4326"
 CRS_STOPS = "EPSG:4326"
 CRS_ZONES = "EPSG:3003"
@@ -30,13 +46,28 @@ zones = zones_gdf.copy()
 # Dissolve all 94 zones to a single city polygon
 torino_poly = zones.unary_union
 torino_gdf = gpd.GeoDataFrame(geometry=[torino_poly], crs=CRS_ZONES)
-zones = zones.to_crs(target_crs)
+zones = zone_data.metric.copy()
 torino_poly_utm = zones.unary_union
 
-csv_path = "Corse_Torino_TUTTI.csv"
 stops_path = "gtt_gtfs/stops.geojson"
 
-df = pd.read_csv(csv_path)
+# hexagon counts at every level of hexgrid.HEX_SIZES_M (origins, destinations, OD)
+hex_path = "Corse_Torino_hex.npz"
+HEX_PLOT_SIZE_M = 200
+
+df = carica_corse(
+    colonne=[
+        "OPERATORE",
+        "DATAORA_INIZIO",
+        "LATITUDINE_INIZIO_CORSA",
+        "LONGITUTIDE_INIZIO_CORSA",
+        "LATITUDINE_FINE_CORSA",
+        "LONGITUTIDE_FINE_CORSA",
+        "ORIGIN_ZONE",
+        "DEST_ZONE",
+        "DENTRO_ZONE",
+    ]
+)
 
 df = df.dropna(
     subset=[
@@ -76,12 +107,9 @@ stops = stops.to_crs(target_crs)
 # Identify which trips have endpoints within Torino
 print(f"Before clipping: {len(gdf_orig)} origins, {len(gdf_dest)} destinations, {len(stops)} stops")
 
-gdf_orig["orig_within"] = gdf_orig.within(torino_poly_utm)
-gdf_dest["dest_within"] = gdf_dest.within(torino_poly_utm)
-
 # Keep only trips where BOTH endpoints are in Torino
-trips_both_in_torino = set(gdf_orig[gdf_orig["orig_within"]]["trip_id"]) & \
-                       set(gdf_dest[gdf_dest["dest_within"]]["trip_id"])
+# (both endpoints inside one of the 94 zones, assigned once when the trip store is written)
+trips_both_in_torino = set(gdf_orig[gdf_orig["DENTRO_ZONE"]]["trip_id"])
 
 gdf_orig = gdf_orig[gdf_orig["trip_id"].isin(trips_both_in_torino)].copy()
 gdf_dest = gdf_dest[gdf_dest["trip_id"].isin(trips_both_in_torino)].copy()
@@ -90,45 +118,56 @@ stops = stops[stops.within(torino_poly_utm)]
 print(f"After clipping to trips with both endpoints in Torino: {len(gdf_orig)} origins, {len(gdf_dest)} destinations, {len(stops)} stops")
 
 # -----------------------------------------------------------
-# 4. Create buffers around stops
+# 4. Distance from each endpoint to the nearest stop
 # -----------------------------------------------------------
-buffer_m = 300
-stops["buffer"] = stops.geometry.buffer(buffer_m)
+# KD-tree on the stop coordinates (metric CRS): one nearest-neighbour query per endpoint
+# instead of unioning the stop buffers and testing points against the union.
+# "Inside the transit zone" = nearest stop within BUFFER_M, so any radius is a comparison
+stop_tree = cKDTree(np.column_stack([stops.geometry.x, stops.geometry.y]))
 
+def nearest_stop(points):
+    # (distance in metres, position of the stop in `stops`)
+    return stop_tree.query(np.column_stack([points.geometry.x, points.geometry.y]))
 
-try:
-    buffer_union = stops["buffer"].union_all()
-except AttributeError:
-    buffer_union = stops["buffer"].unary_union  
+orig_stop_dist, orig_stop = nearest_stop(gdf_orig)
+dest_stop_dist, dest_stop = nearest_stop(gdf_dest)
 
-# GeoDataFrame of buffer polygons for mapping
+# Stop buffers, only for the map
+stops["buffer"] = stops.geometry.buffer(BUFFER_M)
 buf_gdf = gpd.GeoDataFrame(geometry=stops["buffer"], crs=target_crs)
 
 # -----------------------------------------------------------
 # 5. Classify trips by transit-zone relationship
 # -----------------------------------------------------------
-gdf_orig["orig_in_zone"] = gdf_orig.within(buffer_union)
-gdf_dest["dest_in_zone"] = gdf_dest.within(buffer_union)
-
 trips = pd.DataFrame(
     {
         "trip_id": gdf_orig["trip_id"].values,
-        "orig_in_zone": gdf_orig["orig_in_zone"].values,
-        "dest_in_zone": gdf_dest["dest_in_zone"].values,
+        "operator": gdf_orig["OPERATORE"].astype(str).values,
+        "time_band": np.where(gdf_orig["DATAORA_INIZIO"].dt.hour.isin(TIME_BANDS["peak"]), "peak", "offpeak"),
+        "orig_zone": gdf_orig["ORIGIN_ZONE"].values,
+        "dest_zone": gdf_dest["DEST_ZONE"].values,
+        "orig_stop_dist_m": orig_stop_dist,
+        "dest_stop_dist_m": dest_stop_dist,
+        # nearest stop within SNAP_RADIUS_M (position in `stops`), -1 if none
+        "orig_stop": np.where(orig_stop_dist <= SNAP_RADIUS_M, orig_stop, -1),
+        "dest_stop": np.where(dest_stop_dist <= SNAP_RADIUS_M, dest_stop, -1),
     }
 )
+trips["orig_in_zone"] = trips["orig_stop_dist_m"] <= BUFFER_M
+trips["dest_in_zone"] = trips["dest_stop_dist_m"] <= BUFFER_M
 
-def classify(row):
-    if row["orig_in_zone"] and row["dest_in_zone"]:
-        return "Both endpoints in transit zones"
-    elif row["orig_in_zone"] and not row["dest_in_zone"]:
-        return "Origin only in transit zone"
-    elif not row["orig_in_zone"] and row["dest_in_zone"]:
-        return "Destination only in transit zone"
-    else:
-        return "No endpoint in transit zone"
+CLASSES = np.array([
+    "No endpoint in transit zone",
+    "Destination only in transit zone",
+    "Origin only in transit zone",
+    "Both endpoints in transit zones",
+])
 
-trips["class"] = trips.apply(classify, axis=1)
+def classify(orig_in_zone, dest_in_zone):
+    # class index = 2 * origin + destination
+    return CLASSES[2 * np.asarray(orig_in_zone, dtype=int) + np.asarray(dest_in_zone, dtype=int)]
+
+trips["class"] = classify(trips["orig_in_zone"], trips["dest_in_zone"])
 
 # Attach class back to GeoDataFrames for mapping
 gdf_orig = gdf_orig.merge(trips[["trip_id", "class"]], on="trip_id")
@@ -155,12 +194,113 @@ summary["share"] = summary["count"] / len(trips)
 print("\n=== BREAKDOWN BY CLASS ===")
 print(summary)
 
-import pandas as pd
-import geopandas as gpd
-import matplotlib.pyplot as plt
-from shapely import wkt
-import numpy as np
+# -----------------------------------------------------------
+# 6b. Buffer radius sensitivity
+# -----------------------------------------------------------
+def radius_sweep(trips, radii, by=()):
+    # Share of each class for every radius, per group of the `by` columns (all trips if empty).
+    # Each endpoint gets the index of the first radius that reaches its nearest stop;
+    # one joint histogram of (group, origin index, destination index) and its cumulative
+    # sums give the classes of all radii at once
+    radii = np.sort(np.asarray(radii, dtype=float))
+    k = len(radii)
+    first_orig = np.searchsorted(radii, trips["orig_stop_dist_m"].to_numpy(), side="left")
+    first_dest = np.searchsorted(radii, trips["dest_stop_dist_m"].to_numpy(), side="left")
+    if by:
+        group, groups = pd.MultiIndex.from_frame(trips[list(by)]).factorize()
+    else:
+        group, groups = np.zeros(len(trips), dtype=np.int64), [()]
+    n_groups = len(groups)
+
+    hist = np.bincount(
+        (group * (k + 1) + first_orig) * (k + 1) + first_dest, minlength=n_groups * (k + 1) ** 2
+    ).reshape(n_groups, k + 1, k + 1)
+    total = hist.sum(axis=(1, 2))[:, None]
+    orig_in = hist.sum(axis=2).cumsum(axis=1)[:, :k]
+    dest_in = hist.sum(axis=1).cumsum(axis=1)[:, :k]
+    both = hist.cumsum(axis=1).cumsum(axis=2)[:, np.arange(k), np.arange(k)]
+
+    counts = {
+        "Both endpoints in transit zones": both,
+        "Origin only in transit zone": orig_in - both,
+        "Destination only in transit zone": dest_in - both,
+        "No endpoint in transit zone": total - orig_in - dest_in + both,
+    }
+    index = pd.MultiIndex.from_tuples(
+        [(*g, int(r)) for g in groups for r in radii], names=[*by, "radius_m"]
+    ) if by else pd.Index(radii.astype(int), name="radius_m")
+    shares = pd.DataFrame({name: (c / total).ravel() for name, c in counts.items()}, index=index)
+    shares["trips"] = np.repeat(total.ravel(), k)
+    return shares
+
+sweep_all = radius_sweep(trips, SWEEP_RADII_M)
+sweep_groups = radius_sweep(trips, SWEEP_RADII_M, by=("operator", "time_band"))
+sweep_groups.to_csv(sweep_path)
+
+print("\n=== CLASS SHARE BY BUFFER RADIUS ===")
+print(sweep_all.drop(columns="trips").round(3))
+print(f"Breakdown by operator and time band saved to {sweep_path}")
+
+# -----------------------------------------------------------
+# 6c. Stop-level first/last-mile flows and GTT routes
+# -----------------------------------------------------------
+# Sparse matrices (scipy COO -> CSR, repeated pairs are summed):
+#   last mile  = trips starting at a stop:  stops x destination zones
+#   first mile = trips ending at a stop:    origin zones x stops
+n_stops = len(stops)
+n_zones = len(zone_data)
+
+def sparse_flows(rows, cols, shape):
+    keep = (rows >= 0) & (cols >= 0)
+    values = np.ones(int(keep.sum()), dtype=np.int64)
+    return sparse.coo_matrix((values, (rows[keep], cols[keep])), shape=shape).tocsr()
+
+stop_to_zone = sparse_flows(trips["orig_stop"].to_numpy(), trips["dest_zone"].to_numpy(), (n_stops, n_zones))
+zone_to_stop = sparse_flows(trips["orig_zone"].to_numpy(), trips["dest_stop"].to_numpy(), (n_zones, n_stops))
+sparse.save_npz(stop_flows_path.replace(".npz", "_last_mile.npz"), stop_to_zone)
+sparse.save_npz(stop_flows_path.replace(".npz", "_first_mile.npz"), zone_to_stop)
+
+# stops x routes incidence from the route_ids of each stop: a trip at a stop counts
+# for every route serving it
+stop_routes = stops["route_ids"].reset_index(drop=True).explode().dropna()
+route_code, route_ids = pd.factorize(stop_routes)
+stop_route = sparse.csr_matrix(
+    (np.ones(len(route_code)), (stop_routes.index.to_numpy(), route_code)), shape=(n_stops, len(route_ids))
+)
+
+last_mile_stop = np.asarray(stop_to_zone.sum(axis=1)).ravel()
+first_mile_stop = np.asarray(zone_to_stop.sum(axis=0)).ravel()
+route_flows = pd.DataFrame(
+    {
+        "route_id": route_ids,
+        "first_mile_trips": stop_route.T @ first_mile_stop,
+        "last_mile_trips": stop_route.T @ last_mile_stop,
+    }
+)
+route_flows["trips"] = route_flows["first_mile_trips"] + route_flows["last_mile_trips"]
+route_flows = route_flows.sort_values("trips", ascending=False).astype({
+    "first_mile_trips": int, "last_mile_trips": int, "trips": int,
+})
+route_flows.to_csv(route_flows_path, index=False)
 
+stop_flows = pd.DataFrame(
+    {
+        "stop_id": stops["stop_id"].to_numpy(),
+        "stop_name": stops["stop_name"].to_numpy(),
+        "first_mile_trips": first_mile_stop,
+        "last_mile_trips": last_mile_stop,
+    }
+)
+stop_flows["trips"] = stop_flows["first_mile_trips"] + stop_flows["last_mile_trips"]
+
+print(f"\n=== FIRST/LAST-MILE FLOWS (stops within {SNAP_RADIUS_M} m) ===")
+print(f"Last mile (stop -> zone): {stop_to_zone.sum():,} trips, {stop_to_zone.nnz:,} stop-zone pairs")
+print(f"First mile (zone -> stop): {zone_to_stop.sum():,} trips, {zone_to_stop.nnz:,} zone-stop pairs")
+print("\nTop stops:")
+print(stop_flows.nlargest(10, "trips").to_string(index=False))
+print("\nTop GTT routes feeding scooter trips:")
+print(route_flows.head(10).to_string(index=False))
+print(f"Route table saved to {route_flows_path}")
 
 # -----------------------------------------------------------
 # 7. IMPROVED Map: Single map with better readability
@@ -211,19 +351,35 @@ plt.savefig("torino_escooter_pt_clean.png", dpi=300, bbox_inches="tight")
 plt.show()
 
 # -----------------------------------------------------------
-# 8. ALTERNATIVE: Hexbin density map (even cleaner)
+# 8. ALTERNATIVE: Hexagon density map (even cleaner)
 # -----------------------------------------------------------
+# Hexagon grid at several resolutions (25 m block level to 3.2 km city level), one pass
+# over the trip endpoints; coarser levels are sums of their children (see hexgrid.py)
+hex_pyramid = HexPyramid.from_points(
+    gdf_orig.geometry.x.to_numpy(), gdf_orig.geometry.y.to_numpy(),
+    gdf_dest.geometry.x.to_numpy(), gdf_dest.geometry.y.to_numpy(),
+)
+hex_pyramid.save(hex_path)
+print("\n=== HEXAGON GRID ===")
+for size, level in zip(HEX_SIZES_M, hex_pyramid.levels):
+    print(f"{size:>5} m: {len(level['cells']):,} cells, {len(level['od_count']):,} OD pairs")
+
 fig, ax = plt.subplots(1, 1, figsize=(12, 12))
 
 zones.boundary.plot(ax=ax, color="black", linewidth=0.5, alpha=0.5)
 stops.plot(ax=ax, color="red", markersize=3, alpha=0.6, zorder=3, label="PT stops")
 
-# Hexbin for origins
-x = gdf_orig.geometry.x
-y = gdf_orig.geometry.y
-hexbin = ax.hexbin(x, y, gridsize=50, cmap='YlOrRd', alpha=0.7, edgecolors='none', mincnt=1)
+# Origins per hexagon
+hex_cells = hex_pyramid.cells(HEX_PLOT_SIZE_M)
+hex_cells = hex_cells[hex_cells["origins"] > 0]
+hex_gdf = gpd.GeoDataFrame(
+    hex_cells, geometry=hex_polygons(hex_cells["cell"].to_numpy(), HEX_PLOT_SIZE_M), crs=target_crs
+)
+hex_gdf.plot(
+    ax=ax, column="origins", cmap='YlOrRd', alpha=0.7, edgecolor='none',
+    legend=True, legend_kwds={"label": "Trip count per hexagon", "shrink": 0.8},
+)
 
-cb = plt.colorbar(hexbin, ax=ax, label="Trip count per hexagon")
 ax.set_title("E-scooter trip origin density - Torino", fontsize=16, pad=20)
 ax.legend(loc="upper left")
 ax.set_axis_off()
@@ -0,0 +1,154 @@
+import numpy as np
+import pandas as pd
+import shapely
+
+# ----------------------------
+# Hierarchical hexagonal grid on metric coordinates (EPSG:32632), finer than the 94 zones.
+# Pointy-top hexagons with axial coordinates (q, r), computed with plain numpy on the
+# x / y arrays. HEX_SIZES_M are the hexagon sizes (centre-to-vertex) from the finest level
+# to the coarsest; each level is twice the previous one.
+# The parent of a cell is the coarser hexagon containing its centre (as in H3, hexagons do
+# not nest exactly), so the counts of a level are always the sum of the counts of its
+# children and zooming out never goes back to the trips.
+# ----------------------------
+HEX_SIZES_M = (25, 50, 100, 200, 400, 800, 1600, 3200)
+
+# cell keys: q and r packed in one int64 (32 bits each, offset to stay positive)
+KEY_OFFSET = 1 << 30
+
+SQRT3 = np.sqrt(3.0)
+
+
+def hex_axial(x, y, size):
+    # (q, r) int64 of the hexagon of side `size` containing each point (cube rounding)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    q = (SQRT3 / 3 * x - y / 3) / size
+    r = (2 / 3 * y) / size
+    s = -q - r
+
+    rq, rr, rs = np.round(q), np.round(r), np.round(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    rq = np.where(fix_q, -rr - rs, rq)
+    rr = np.where(fix_r, -rq - rs, rr)
+    return rq.astype(np.int64), rr.astype(np.int64)
+
+
+def hex_center(q, r, size):
+    q = np.asarray(q, dtype=np.float64)
+    r = np.asarray(r, dtype=np.float64)
+    return size * SQRT3 * (q + r / 2), size * 1.5 * r
+
+
+def hex_key(q, r):
+    return ((np.asarray(q, dtype=np.int64) + KEY_OFFSET) << 32) | (np.asarray(r, dtype=np.int64) + KEY_OFFSET)
+
+
+def key_axial(key):
+    key = np.asarray(key, dtype=np.int64)
+    return (key >> 32) - KEY_OFFSET, (key & 0xFFFFFFFF) - KEY_OFFSET
+
+
+def point_keys(x, y, size):
+    return hex_key(*hex_axial(x, y, size))
+
+
+def hex_polygons(keys, size):
+    # shapely polygons of the cells, one vectorised call (for maps)
+    cx, cy = hex_center(*key_axial(keys), size)
+    angles = np.deg2rad(30 + 60 * np.arange(6))
+    ring = np.stack([cx[:, None] + size * np.cos(angles), cy[:, None] + size * np.sin(angles)], axis=-1)
+    return shapely.polygons(ring)
+
+
+def parent_keys(keys, child_size, parent_size):
+    # coarser cell containing the centre of each cell
+    return point_keys(*hex_center(*key_axial(keys), child_size), parent_size)
+
+
+def sum_by_key(keys, counts):
+    # sorted unique keys and the summed counts
+    unique, inverse = np.unique(keys, return_inverse=True)
+    return unique, np.bincount(inverse, weights=counts, minlength=len(unique)).astype(np.int64)
+
+
+class HexPyramid:
+    # levels[i] (size HEX_SIZES_M[i]) is a dict of arrays:
+    #   cells, origins, destinations: sorted cell keys and trips starting / ending there
+    #   od_origin, od_dest, od_count: sparse OD between cells (nonzero pairs only)
+    def __init__(self, levels, sizes=HEX_SIZES_M):
+        self.levels = levels
+        self.sizes = tuple(sizes)
+
+    @classmethod
+    def from_points(cls, x_orig, y_orig, x_dest, y_dest, sizes=HEX_SIZES_M):
+        # One pass over the trips at the finest level (metric coordinates, same length);
+        # every coarser level is summed from the level below, through the parent of each cell
+        n_trips = len(x_orig)
+        keys = np.concatenate([point_keys(x_orig, y_orig, sizes[0]), point_keys(x_dest, y_dest, sizes[0])])
+        cells, position = np.unique(keys, return_inverse=True)
+        ones = np.ones(n_trips, dtype=np.int64)
+        level = cls._level(cells, position[:n_trips], position[n_trips:], ones)
+        levels = [level]
+
+        for child_size, size in zip(sizes[:-1], sizes[1:]):
+            cells, parent = np.unique(parent_keys(level["cells"], child_size, size), return_inverse=True)
+            n_child = len(level["cells"])
+            pairs = level["pairs"]
+            level = cls._level(cells, parent[pairs // n_child], parent[pairs % n_child], level["od_count"],
+                               parent, level["origins"], level["destinations"])
+            levels.append(level)
+        return cls([cls._public(level) for level in levels], sizes)
+
+    @staticmethod
+    def _level(cells, origin, dest, counts, parent=None, child_origins=None, child_destinations=None):
+        # origin / dest: positions in cells; counts: trips of each (origin, dest) item.
+        # Origin and destination totals of a coarser level come from the child cells
+        n = len(cells)
+        if parent is None:
+            origins = np.bincount(origin, minlength=n)
+            destinations = np.bincount(dest, minlength=n)
+        else:
+            origins = np.bincount(parent, weights=child_origins, minlength=n).astype(np.int64)
+            destinations = np.bincount(parent, weights=child_destinations, minlength=n).astype(np.int64)
+        # OD pairs coded as origin position * n + destination position
+        pairs, od_count = sum_by_key(origin * n + dest, counts)
+        return {"cells": cells, "origins": origins, "destinations": destinations,
+                "pairs": pairs, "od_count": od_count}
+
+    @staticmethod
+    def _public(level):
+        n = len(level["cells"])
+        return {"cells": level["cells"], "origins": level["origins"], "destinations": level["destinations"],
+                "od_origin": level["cells"][level["pairs"] // n], "od_dest": level["cells"][level["pairs"] % n],
+                "od_count": level["od_count"]}
+
+    def level_index(self, size):
+        return self.sizes.index(size)
+
+    def cells(self, size):
+        # origins / destinations per cell at one level, with the cell centres
+        level = self.levels[self.level_index(size)]
+        cx, cy = hex_center(*key_axial(level["cells"]), size)
+        return pd.DataFrame({"cell": level["cells"], "x": cx, "y": cy,
+                             "origins": level["origins"], "destinations": level["destinations"]})
+
+    def od(self, size):
+        level = self.levels[self.level_index(size)]
+        return pd.DataFrame({"origin": level["od_origin"], "dest": level["od_dest"], "count": level["od_count"]})
+
+    def save(self, path):
+        arrays = {"sizes": np.array(self.sizes)}
+        for i, level in enumerate(self.levels):
+            arrays.update({f"{i}_{name}": values for name, values in level.items()})
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            sizes = tuple(int(s) for s in data["sizes"])
+            names = ("cells", "origins", "destinations", "od_origin", "od_dest", "od_count")
+            levels = [{name: data[f"{i}_{name}"] for name in names} for i in range(len(sizes))]
+        return cls(levels, sizes)
@@ -0,0 +1,8 @@
+import sys
+from pathlib import Path
+
+# stessi percorsi che gli script aggiungono a sys.path quando sono eseguiti
+root_dir = Path(__file__).resolve().parent.parent
+for percorso in (root_dir, root_dir / "ESERCIZIO 1", root_dir / "ESERCIZIO 3"):
+    if str(percorso) not in sys.path:
+        sys.path.insert(0, str(percorso))
@@ -0,0 +1,138 @@
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from aggregati_od import aggiorna_aggregati, carica_cubo_od
+from ingest import ingest_incrementale, ingest_parallelo, ingest_streaming
+from trip_store import carica_corse
+from zone_corse import zone_torino
+
+root_dir = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture
+def cartella(tmp_path, monkeypatch):
+    # cartella di lavoro temporanea: cartelle operatore vuote e file delle zone del progetto
+    for nome in ("OPERATORE A", "OPERATORE B", "OPERATORE C"):
+        (tmp_path / nome).mkdir()
+    shutil.copytree(root_dir / "zone_statistiche_csv", tmp_path / "zone_statistiche_csv")
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def export_lime(destinazioni, giorno="2024-05-10", veicolo="L"):
+    # una corsa all'ora dalla zona 0 alla zona indicata, velocità valida
+    punti = zone_torino().geo.geometry.representative_point()
+    righe = []
+    for i, zona in enumerate(destinazioni):
+        inizio = pd.Timestamp(f"{giorno} 08:00:00") + pd.Timedelta(hours=i)
+        righe.append({
+            "ID_VEICOLO": f"{veicolo}{i:05d}",
+            "DATAORA_INIZIO": str(inizio),
+            "DATAORA_FINE": str(inizio + pd.Timedelta(minutes=6)),
+            "LATITUDINE_INIZIO_CORSA": punti.y.iloc[0],
+            "LONGITUTIDE_INIZIO_CORSA": punti.x.iloc[0],
+            "LATITUDINE_FINE_CORSA": punti.y.iloc[zona],
+            "LONGITUTIDE_FINE_CORSA": punti.x.iloc[zona],
+            "DISTANZA_KM": 1.0,
+            "DURATA_MIN": 6.0,
+            "RISERVATO": False,
+            "BATTERIA_INIZIO_CORSA": 80,
+            "BATTERIA_FINE_CORSA": 70,
+            "ID_ORGANIZZAZIONE": "LIMEORG",
+            "OPERATORE": "LIME",
+            "PERCORSO": "",
+        })
+    return pd.DataFrame(righe)
+
+
+def carica(percorso, df):
+    df.to_csv(percorso, index=False)
+    conteggi, partizioni = ingest_incrementale("Corse_Torino_TUTTI.csv")
+    aggiorna_aggregati(partizioni)
+    return conteggi, partizioni
+
+
+def test_sostituzione_corregge_il_cubo(cartella):
+    carica("OPERATORE A/Corse_Torino_LIME.csv", export_lime([1, 1, 1]))
+    cubo = carica_cubo_od()
+    lime = cubo.operators.index("LIME")
+    assert cubo.counts[lime, ..., 0, 1].sum() == 3
+
+    # riconsegna del mese: la seconda corsa finisce in un'altra zona, quindi ha un'altra
+    # chiave canonica e senza la sostituzione sarebbe contata due volte
+    conteggi, partizioni = carica("OPERATORE A/Corse_Torino_LIME_sostituzione_2024-05.csv", export_lime([1, 2, 1]))
+    assert partizioni == {("LIME", "2024-05")}
+    assert conteggi["partizioni_sostituite"] == 1
+    assert conteggi["corse_ritirate"] == 3
+
+    cubo = carica_cubo_od()
+    assert cubo.counts[lime, ..., 0, 1].sum() == 2
+    assert cubo.counts[lime, ..., 0, 2].sum() == 1
+    assert cubo.counts.sum() == 3
+    assert len(carica_corse()) == 3
+    assert len(pd.read_csv("Corse_Torino_TUTTI.csv")) == 3
+
+    # stesso cubo di una ricostruzione completa degli aggregati dal trip store
+    aggiorna_aggregati()
+    assert np.array_equal(carica_cubo_od().counts, cubo.counts)
+
+
+def test_sostituzione_ricaricata_dopo_modifica(cartella):
+    carica("OPERATORE A/Corse_Torino_LIME.csv", export_lime([1, 1, 1]))
+    carica("OPERATORE A/Corse_Torino_LIME_sostituzione_2024-05.csv", export_lime([1, 2, 1]))
+
+    # l'operatore corregge di nuovo la stessa riconsegna
+    conteggi, _ = carica("OPERATORE A/Corse_Torino_LIME_sostituzione_2024-05.csv", export_lime([2, 2, 1]))
+    assert conteggi["file_modificati"] == 1
+
+    cubo = carica_cubo_od()
+    lime = cubo.operators.index("LIME")
+    assert cubo.counts[lime, ..., 0, 1].sum() == 1
+    assert cubo.counts[lime, ..., 0, 2].sum() == 2
+    assert len(carica_corse()) == 3
+
+
+def corse(df):
+    return sorted(zip(df["ID_VEICOLO"].astype(str), df["DATAORA_INIZIO"], df["DEST_ZONE"]))
+
+
+def test_tutte_le_modalita_leggono_ogni_export(cartella):
+    # storico, export mensile e sostituzione di maggio: stesse corse in ogni modalità
+    export_lime([1, 1, 1]).to_csv("OPERATORE A/Corse_Torino_LIME.csv", index=False)
+    export_lime([3, 4], "2024-06-10", "M").to_csv("OPERATORE A/Corse_Torino_LIME_2024-06.csv", index=False)
+    export_lime([1, 2, 1]).to_csv("OPERATORE A/Corse_Torino_LIME_sostituzione_2024-05.csv", index=False)
+
+    ingest_incrementale("Corse_Torino_TUTTI.csv")
+    attese = corse(carica_corse())
+    assert len(attese) == 5
+    assert sorted(z for _, _, z in attese) == [1, 1, 2, 3, 4]
+
+    conteggi = ingest_streaming("Corse_Torino_TUTTI.csv")
+    assert conteggi["escluse_sostituzione"] == 3
+    assert corse(carica_corse()) == attese
+    data_all, conteggi, _ = ingest_parallelo(max_workers=2)
+    assert conteggi["escluse_sostituzione"] == 3
+    assert corse(data_all) == attese
+
+
+def test_storico_ricaricato_dopo_sostituzione(cartella):
+    carica("OPERATORE A/Corse_Torino_LIME.csv", export_lime([1, 1, 1]))
+    carica("OPERATORE A/Corse_Torino_LIME_sostituzione_2024-05.csv", export_lime([1, 2, 1]))
+
+    # l'operatore ripubblica lo storico con una corsa di giugno in più: maggio resta
+    # quello della sostituzione
+    storico = pd.concat([export_lime([1, 1, 1]), export_lime([3], "2024-06-10", "M")])
+    conteggi, partizioni = carica("OPERATORE A/Corse_Torino_LIME.csv", storico)
+    assert conteggi["file_modificati"] == 1
+    assert conteggi["escluse_sostituzione"] == 3
+
+    cubo = carica_cubo_od()
+    lime = cubo.operators.index("LIME")
+    assert cubo.counts[lime, ..., 0, 1].sum() == 2
+    assert cubo.counts[lime, ..., 0, 2].sum() == 1
+    assert cubo.counts[lime, ..., 0, 3].sum() == 1
+    assert len(carica_corse()) == 4
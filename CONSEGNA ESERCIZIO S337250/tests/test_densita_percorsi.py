@@ -0,0 +1,46 @@
+import numpy as np
+from pyproj import Transformer
+
+from densita_percorsi import CRS_METRICO, brucia_tracce, raster_vuoto
+from zones import GRID_BOUNDS
+
+# centro di Torino e punti vicini (lon, lat)
+TRACCIA = [(7.680, 45.070), (7.690, 45.072), (7.700, 45.068), (7.705, 45.075)]
+
+
+def brucia(tracce, cella_m=50):
+    # tracce: liste di punti lon/lat -> raster con le tracce bruciate
+    trasformatore = Transformer.from_crs("EPSG:4326", CRS_METRICO, always_xy=True)
+    punti = np.array([p for t in tracce for p in t], dtype=np.float64).reshape(-1, 2)
+    x, y = trasformatore.transform(punti[:, 0], punti[:, 1])
+    offsets = np.concatenate([[0], np.cumsum([len(t) for t in tracce])])
+    return brucia_tracce(raster_vuoto(cella_m), np.column_stack([x, y]), offsets)["conteggi"]
+
+
+def test_traccia_attraversa_celle():
+    conteggi = brucia([TRACCIA])
+    assert conteggi.max() == 1
+    assert conteggi.sum() > 50
+
+
+def test_punto_non_finito_spezza_la_traccia():
+    # il punto NaN toglie i due segmenti che lo toccano, non il resto della traccia
+    con_nan = TRACCIA[:2] + [(np.nan, np.nan)] + TRACCIA[2:]
+    atteso = np.maximum(brucia([TRACCIA[:2]]), brucia([TRACCIA[2:]]))
+    assert np.array_equal(brucia([con_nan]), atteso)
+
+
+def test_punto_a_zero_zero():
+    # errore GPS a (0, 0): fuori dal raster, nessun segmento verso quel punto
+    con_zero = TRACCIA[:2] + [(0.0, 0.0)] + TRACCIA[2:]
+    atteso = np.maximum(brucia([TRACCIA[:2]]), brucia([TRACCIA[2:]]))
+    assert np.array_equal(brucia([con_zero]), atteso)
+    # tracce fatte solo di punti non validi: nessuna cella, nessun errore
+    assert brucia([[(0.0, 0.0), (7.68, 450.0)], [(np.inf, 45.0)]]).sum() == 0
+
+
+def test_traccia_che_esce_dal_raster():
+    # fine corsa poco oltre il bordo nord: il tratto dentro il raster resta contato
+    fuori = (7.690, GRID_BOUNDS[3] + 0.01)
+    dentro = (7.690, GRID_BOUNDS[3] - 0.01)
+    assert brucia([[dentro, fuori]]).sum() >= 20
@@ -0,0 +1,59 @@
+import numpy as np
+
+from geometrie_percorso import parse_percorsi, tokenizza_percorsi
+
+# tutti questi testi erano letti da parse_geom (ast.literal_eval + LineString)
+LINEA = [[7.6, 45.0], [7.7, 45.1]]
+
+
+def punti(testi):
+    coordinate, offsets, malformati = tokenizza_percorsi(testi)
+    return [coordinate[offsets[i]:offsets[i + 1]].tolist() for i in range(len(testi))], malformati
+
+
+def test_lista_di_liste():
+    tracce, malformati = punti(["[[7.6, 45.0], [7.7, 45.1]]"])
+    assert tracce == [LINEA]
+    assert not malformati.any()
+
+
+def test_lista_di_tuple():
+    tracce, malformati = punti(["[(7.6, 45.0), (7.7, 45.1)]", "[(7.6, 45.0,), [7.7, 45.1],]"])
+    assert tracce == [LINEA, LINEA]
+    assert not malformati.any()
+
+
+def test_coordinate_3d_senza_quota():
+    tracce, malformati = punti(["[[7.6, 45.0, 230.5], [7.7, 45.1, 231]]", "[(7.6, 45.0, 1), (7.7, 45.1, 2)]"])
+    assert tracce == [LINEA, LINEA]
+    assert not malformati.any()
+
+
+def test_numeri_senza_cifra_intera():
+    tracce, malformati = punti(["[[.5, -.25], [+1., 2e-1]]"])
+    assert tracce == [[[0.5, -0.25], [1.0, 0.2]]]
+    assert not malformati.any()
+
+
+def test_formato_dict():
+    tracce, malformati = punti([
+        "{'type': 'LineString', 'coordinates': [[7.6, 45.0], [7.7, 45.1]]}",
+        "{'type': 'LineString', 'coordinates': [(7.6, 45.0), (7.7, 45.1)]}",
+        '{"type": "LineString", "coordinates": ((7.6, 45.0, 1), (7.7, 45.1, 2))}',
+    ])
+    assert tracce == [LINEA, LINEA, LINEA]
+    assert not malformati.any()
+
+
+def test_malformati_e_vuoti():
+    testi = ["garbage[", "[[1, 2, 3, 4], [5, 6]]", "[[1, 2)]", "[]", None]
+    tracce, malformati = punti(testi)
+    assert tracce == [[]] * len(testi)
+    assert malformati.tolist() == [True, True, True, False, False]
+
+
+def test_geometrie():
+    geometrie, _ = parse_percorsi(["[(7.6, 45.0), (7.7, 45.1)]", "[[7.6, 45.0]]", None])
+    assert np.allclose(np.asarray(geometrie[0].coords), LINEA)
+    assert not geometrie[0].has_z
+    assert geometrie[1] is None and geometrie[2] is None
@@ -0,0 +1,29 @@
+import pandas as pd
+
+from ingest import TIPO_DATA, parse_datetime_veloce
+
+FRAZIONI = [
+    "2024-05-10 08:00:00.5",
+    "2024-05-10 08:00:01.123456",
+    "2024-05-10 08:00:02.123456789",
+    "2024-05-10T08:00:03.25",
+    None,
+]
+
+
+def test_date_con_frazioni_di_secondo():
+    valori = pd.Series(FRAZIONI * 20)
+    date, lente = parse_datetime_veloce(valori)
+    assert date.dtype == TIPO_DATA
+    atteso = pd.to_datetime(valori, format="mixed", yearfirst=True).astype(TIPO_DATA)
+    assert date.equals(atteso)
+    assert date[2] == pd.Timestamp("2024-05-10 08:00:02.123456")
+
+
+def test_formati_diversi_nella_stessa_colonna():
+    # il formato più diffuso sul campione non ha frazioni, il secondo sì (%f con 9 cifre)
+    valori = pd.Series(["2024-05-10 08:00:00"] * 50 + ["2024-05-10 08:00:00.123456789"] * 10)
+    date, lente = parse_datetime_veloce(valori)
+    assert date.dtype == TIPO_DATA
+    assert date.iloc[-1] == pd.Timestamp("2024-05-10 08:00:00.123456")
+    assert lente == 0
@@ -0,0 +1,33 @@
+import pandas as pd
+
+from schema import applica_schema
+
+
+def blocco(riservato):
+    return pd.DataFrame({
+        "ID_VEICOLO": ["V1"] * len(riservato),
+        "LATITUDINE_INIZIO_CORSA": 45.07,
+        "LONGITUTIDE_INIZIO_CORSA": 7.68,
+        "LATITUDINE_FINE_CORSA": 45.08,
+        "LONGITUTIDE_FINE_CORSA": 7.69,
+        "DISTANZA_KM": 1.0,
+        "DURATA_MIN": 6.0,
+        "RISERVATO": riservato,
+        "BATTERIA_INIZIO_CORSA": 80,
+        "BATTERIA_FINE_CORSA": 70,
+        "OPERATORE": "LIME",
+    })
+
+
+def test_riservato_testo():
+    df = applica_schema(blocco(["SI", " no ", "Sì", "1.0", "0", "true", None]))
+    assert df["RISERVATO"].dtype == "boolean"
+    assert df["RISERVATO"].tolist() == [True, False, True, True, False, True, pd.NA]
+
+
+def test_riservato_sconosciuto_diventa_na():
+    # un valore non riconosciuto non scarta la corsa e non aggiunge colonne
+    df = applica_schema(blocco(["forse", "NO"]))
+    assert len(df) == 2
+    assert df["RISERVATO"].tolist() == [pd.NA, False]
+    assert list(df.columns) == list(blocco(["NO"]).columns)
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+import shapely
+from pyproj import Transformer
+
+from sovrapposizione_percorsi import CRS_METRICO, inizializza_worker, misura_blocco
+
+# centro di Torino e punti vicini (lon, lat)
+TRACCIA = [(7.680, 45.070), (7.690, 45.072), (7.700, 45.068), (7.705, 45.075)]
+
+
+def misura(tracce):
+    # una fermata sul primo punto, tracce come WKB in EPSG:4326
+    trasformatore = Transformer.from_crs("EPSG:4326", CRS_METRICO, always_xy=True)
+    inizializza_worker(np.array([trasformatore.transform(*TRACCIA[0])]))
+    wkb = shapely.to_wkb(np.array([shapely.LineString(t) for t in tracce]))
+    return misura_blocco(np.arange(len(tracce)), wkb)
+
+
+# shapely avvisa dei NaN nelle coordinate, voluti in questo test
+@pytest.mark.filterwarnings("ignore:invalid value encountered")
+def test_punti_errati_spezzano_la_traccia():
+    con_nan = TRACCIA[:2] + [(np.nan, np.nan)] + TRACCIA[2:]
+    con_zero = TRACCIA[:2] + [(0.0, 0.0)] + TRACCIA[2:]
+    risultato = misura([con_nan, con_zero, TRACCIA[:2], TRACCIA[2:]])
+    atteso = risultato["LUNGHEZZA_M"].iloc[2] + risultato["LUNGHEZZA_M"].iloc[3]
+    assert np.allclose(risultato["LUNGHEZZA_M"].iloc[:2], atteso)
+    assert np.allclose(risultato["LUNGHEZZA_CORRIDOIO_M"].iloc[:2], risultato["LUNGHEZZA_CORRIDOIO_M"].iloc[2:].sum())
+
+
+def test_traccia_di_soli_punti_errati():
+    risultato = misura([[(0.0, 0.0), (7.68, 450.0)], TRACCIA])
+    assert risultato["LUNGHEZZA_M"].iloc[0] == 0
+    assert np.isnan(risultato["QUOTA_CORRIDOIO"].iloc[0])
+    assert 0 < risultato["QUOTA_CORRIDOIO"].iloc[1] < 1
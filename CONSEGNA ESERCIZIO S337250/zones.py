@@ -0,0 +1,263 @@
+import hashlib
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+# ----------------------------
+# Shared loader for the 94 statistical zones of Torino.
+# The CSV (WKT polygons in EPSG:3003) is parsed and reprojected once; the result is
+# cached as GeoParquet, keyed by the SHA-256 of the source file, so every later
+# load is a binary read. Editing or replacing the CSV invalidates the cache.
+# ----------------------------
+ZONES_FILE = "zone_statistiche_csv/zone_statistiche.csv"
+ZONES_CACHE_DIR = "zone_statistiche_cache"
+
+CRS_SOURCE = "EPSG:3003"
+CRS_GEO = "EPSG:4326"
+CRS_METRIC = "EPSG:32632"
+
+# Lookup grid for assign_zones: zone code per cell over the same box used by the
+# cleaning filter of Exercise 1 (regole_pulizia.SOGLIE), lon_min, lat_min, lon_max, lat_max.
+# 0.0002 deg ~ 16 x 22 m cells -> 1500 x 1000 int16 grid (3 MB)
+GRID_BOUNDS = (7.5, 44.9, 7.8, 45.1)
+GRID_CELL_DEG = 0.0002
+# code of cells crossed by a zone border: their points get the exact polygon test
+GRID_BORDER = -2
+
+
+class Zones:
+    # geo / metric: same rows (same order, same index) in EPSG:4326 and EPSG:32632,
+    # with AREA_M2 and centroid coordinates in both CRS as plain columns.
+    # The spatial indexes are built here, so the first query does not pay for them.
+    def __init__(self, geo, metric, key=None):
+        self.key = key
+        self.grid = None
+        self.geo = geo
+        self.metric = metric
+        self.area_m2 = metric["AREA_M2"].to_numpy()
+        self.centroids_geo = gpd.GeoSeries.from_xy(geo["CENTROID_LON"], geo["CENTROID_LAT"], crs=CRS_GEO)
+        self.centroids_metric = gpd.GeoSeries.from_xy(metric["CENTROID_X"], metric["CENTROID_Y"], crs=CRS_METRIC)
+        self.sindex_geo = geo.sindex
+        self.sindex_metric = metric.sindex
+
+    def __len__(self):
+        return len(self.geo)
+
+
+def file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def read_zones_csv(path=ZONES_FILE):
+    # The file has been exported with different encodings / separators over time
+    zones_df = None
+    for sep in [";", ","]:
+        for encoding in ["latin1", "cp1252"]:
+            try:
+                zones_df = pd.read_csv(path, sep=sep, encoding=encoding)
+            except (UnicodeDecodeError, pd.errors.ParserError):
+                continue
+            break
+        if zones_df is not None and "WKT_GEOM" in zones_df.columns:
+            break
+    if zones_df is None or "WKT_GEOM" not in zones_df.columns:
+        raise ValueError(f"{path}: WKT_GEOM column not found")
+
+    # vectorised WKT parsing (one call for all rows)
+    geometry = shapely.from_wkt(zones_df["WKT_GEOM"].to_numpy())
+    return gpd.GeoDataFrame(zones_df.drop(columns="WKT_GEOM"), geometry=geometry, crs=CRS_SOURCE)
+
+
+def build_zones(path=ZONES_FILE):
+    zones = read_zones_csv(path)
+
+    # areas and centroids are computed in the metric CRS, then the centroids
+    # are reprojected, so they are the same points in both tables
+    metric = zones.to_crs(CRS_METRIC)
+    centroids = metric.geometry.centroid
+    centroids_geo = centroids.to_crs(CRS_GEO)
+
+    derived = {
+        "AREA_M2": metric.geometry.area,
+        "CENTROID_X": centroids.x,
+        "CENTROID_Y": centroids.y,
+        "CENTROID_LON": centroids_geo.x,
+        "CENTROID_LAT": centroids_geo.y,
+    }
+    # polygons reprojected from the source CRS directly, as the scripts did before
+    geo = zones.to_crs(CRS_GEO).assign(**derived)
+    return geo, metric.assign(**derived)
+
+
+def load_zones(path=ZONES_FILE, cache_dir=ZONES_CACHE_DIR):
+    key = file_hash(path)[:16]
+    geo_path = os.path.join(cache_dir, f"zones_{key}_4326.parquet")
+    metric_path = os.path.join(cache_dir, f"zones_{key}_32632.parquet")
+
+    if os.path.exists(geo_path) and os.path.exists(metric_path):
+        return Zones(gpd.read_parquet(geo_path), gpd.read_parquet(metric_path), key)
+
+    geo, metric = build_zones(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    # drop caches of older versions of the file
+    for name in os.listdir(cache_dir):
+        if name.startswith("zones_") and key not in name:
+            os.remove(os.path.join(cache_dir, name))
+    geo.to_parquet(geo_path)
+    metric.to_parquet(metric_path)
+    return Zones(geo, metric, key)
+
+
+def assign_zones(zones, lon, lat):
+    # Point-in-zone on raw coordinate arrays, without building Point objects.
+    # lon / lat can have any (same) shape: np.stack([lon_origin, lon_dest]) assigns
+    # origins and destinations in one call and returns a (2, n) array.
+    # Returns int16 zone codes = row position in zones.geo / zones.metric, -1 outside
+    # every zone (or NaN). Same predicate as sjoin "within": points on a border are outside.
+    # Most points are resolved by an index lookup in the zone grid; points in border
+    # cells or outside the grid box go through assign_zones_exact.
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    x = lon.ravel()
+    y = lat.ravel()
+
+    grid = zone_grid(zones)
+    lon_min, lat_min = GRID_BOUNDS[0], GRID_BOUNDS[1]
+    col = np.floor((x - lon_min) / GRID_CELL_DEG)
+    row = np.floor((y - lat_min) / GRID_CELL_DEG)
+    in_grid = (col >= 0) & (col < grid.shape[1]) & (row >= 0) & (row < grid.shape[0])
+
+    codes = np.full(x.size, GRID_BORDER, dtype=np.int16)
+    codes[in_grid] = grid[row[in_grid].astype(np.intp), col[in_grid].astype(np.intp)]
+    exact = codes == GRID_BORDER
+    codes[exact] = assign_zones_exact(zones, x[exact], y[exact])
+    return codes.reshape(lon.shape)
+
+
+def assign_zones_exact(zones, lon, lat):
+    # Exact polygon test for every point, same arguments and result as assign_zones
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    x = lon.ravel()
+    y = lat.ravel()
+    codes = np.full(x.size, -1, dtype=np.int16)
+
+    # points sorted by longitude (NaN last): the candidates of a zone are the slice
+    # inside its bounding box, found with two binary searches
+    order = np.argsort(x, kind="stable")
+    x_sorted = x[order]
+
+    geometries = zones.geo.geometry.to_numpy()
+    shapely.prepare(geometries)
+    bounds = shapely.bounds(geometries)
+    for code, (geometry, (minx, miny, maxx, maxy)) in enumerate(zip(geometries, bounds)):
+        start = np.searchsorted(x_sorted, minx, side="left")
+        end = np.searchsorted(x_sorted, maxx, side="right")
+        candidates = order[start:end]
+        candidates = candidates[(y[candidates] >= miny) & (y[candidates] <= maxy) & (codes[candidates] < 0)]
+        inside = shapely.contains_xy(geometry, x[candidates], y[candidates])
+        codes[candidates[inside]] = code
+    return codes.reshape(lon.shape)
+
+
+def build_grid(zones):
+    lon_min, lat_min, lon_max, lat_max = GRID_BOUNDS
+    n_cols = int(np.ceil((lon_max - lon_min) / GRID_CELL_DEG))
+    n_rows = int(np.ceil((lat_max - lat_min) / GRID_CELL_DEG))
+
+    # zone of each cell centre
+    cols, rows = np.meshgrid(np.arange(n_cols), np.arange(n_rows))
+    grid = assign_zones_exact(
+        zones,
+        lon_min + (cols + 0.5) * GRID_CELL_DEG,
+        lat_min + (rows + 0.5) * GRID_CELL_DEG,
+    )
+
+    # cells crossed by a border: borders densified to half a cell, so every border
+    # point is within one cell of a vertex; each vertex marks its cell and the 8 around it.
+    # All other cells lie inside a single zone (or none), the one of their centre.
+    borders = shapely.segmentize(shapely.boundary(zones.geo.geometry.to_numpy()), GRID_CELL_DEG / 2)
+    vertices = shapely.get_coordinates(borders)
+    col = np.floor((vertices[:, 0] - lon_min) / GRID_CELL_DEG).astype(np.intp)
+    row = np.floor((vertices[:, 1] - lat_min) / GRID_CELL_DEG).astype(np.intp)
+    for d_row in (-1, 0, 1):
+        for d_col in (-1, 0, 1):
+            r = row + d_row
+            c = col + d_col
+            ok = (r >= 0) & (r < n_rows) & (c >= 0) & (c < n_cols)
+            grid[r[ok], c[ok]] = GRID_BORDER
+    return grid
+
+
+def zone_grid(zones, cache_dir=ZONES_CACHE_DIR):
+    # Grid cached next to the zone tables, keyed by the same CSV hash and by the grid
+    # parameters; built once (a few seconds) and then loaded in milliseconds
+    if zones.grid is not None:
+        return zones.grid
+
+    path = None
+    if zones.key is not None:
+        path = os.path.join(cache_dir, f"zones_{zones.key}_grid_{GRID_CELL_DEG}.npz")
+    if path is not None and os.path.exists(path):
+        with np.load(path) as data:
+            if tuple(data["bounds"]) == GRID_BOUNDS:
+                zones.grid = data["grid"]
+                return zones.grid
+
+    zones.grid = build_grid(zones)
+    if path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.savez(path, grid=zones.grid, bounds=np.array(GRID_BOUNDS))
+    return zones.grid
+
+
+def validate_grid(zones, lon, lat):
+    # Validation mode: disagreement of assign_zones against an exact geopandas sjoin
+    # ("within") on the given points
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    points = gpd.GeoDataFrame(geometry=gpd.points_from_xy(lon, lat), crs=CRS_GEO)
+    joined = gpd.sjoin(points, zones.geo[["geometry"]], how="left", predicate="within")
+    joined = joined[~joined.index.duplicated()]
+    reference = zones.geo.index.get_indexer(joined["index_right"])
+    reference[joined["index_right"].isna().to_numpy()] = -1
+
+    codes = assign_zones(zones, lon, lat)
+    grid = zone_grid(zones)
+    disagree = int((codes != reference).sum())
+    return {
+        "points": len(codes),
+        "disagree": disagree,
+        "disagree_share": disagree / max(len(codes), 1),
+        "border_cells_share": float((grid == GRID_BORDER).mean()),
+    }
+
+
+def zone_names(zones, codes, column="DENOM"):
+    # zone codes -> labels (None for -1)
+    values = zones.geo[column].to_numpy()
+    return np.where(codes >= 0, values[codes], None)
+
+
+if __name__ == "__main__":
+    # Validation of the lookup grid on the cleaned trips (run after ESERCIZIO 1/unione.py)
+    import sys
+    from pathlib import Path
+
+    esercizio_1_path = Path(__file__).resolve().parent / "ESERCIZIO 1"
+    if str(esercizio_1_path) not in sys.path:
+        sys.path.insert(0, str(esercizio_1_path))
+    from trip_store import carica_corse
+
+    df = carica_corse(colonne=["LATITUDINE_INIZIO_CORSA", "LONGITUTIDE_INIZIO_CORSA",
+                               "LATITUDINE_FINE_CORSA", "LONGITUTIDE_FINE_CORSA"])
+    lon = np.concatenate([df["LONGITUTIDE_INIZIO_CORSA"], df["LONGITUTIDE_FINE_CORSA"]])
+    lat = np.concatenate([df["LATITUDINE_INIZIO_CORSA"], df["LATITUDINE_FINE_CORSA"]])
+    result = validate_grid(load_zones(), lon, lat)
+    print(f"Points checked: {result['points']:,}")
+    print(f"Disagreements with sjoin: {result['disagree']:,} ({100 * result['disagree_share']:.4f}%)")
+    print(f"Grid cells on a zone border (exact test): {100 * result['border_cells_share']:.1f}%")